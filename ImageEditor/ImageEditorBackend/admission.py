@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rough peak working-set estimate per input pixel for each pipeline (bytes).
+# remove-bg keeps RGBA input, model tensors, mask and cutout alive at once;
+# alpha matting builds several float64 planes on top of that.
+PIPELINE_BYTES_PER_PIXEL = {
+    'remove-bg': 24,
+    'remove-bg-matting': 160,
+    'make-editable': 32,
+    'integrate-text': 12,
+    # per frame: current + previous frame, flow field, masks and PNG encode
+    'remove-bg-video': 48,
+}
+DEFAULT_BYTES_PER_PIXEL = 24
+# /remove-bg results restored to the original size: full-size RGBA plus upscaled alpha
+RESTORE_BYTES_PER_PIXEL = 5
+# Fixed overhead per request (decoder buffers, PNG encode, response copy)
+BASE_REQUEST_MB = 16
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within the configured budget."""
+
+    def __init__(self, reason, retry_after=1):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_cost_mb(width, height, pipeline):
+    """Estimate the peak memory (MB) a request will need from its image size."""
+    bytes_per_pixel = PIPELINE_BYTES_PER_PIXEL.get(pipeline, DEFAULT_BYTES_PER_PIXEL)
+    pixels = max(0, int(width)) * max(0, int(height))
+    return BASE_REQUEST_MB + pixels * bytes_per_pixel / (1024 * 1024)
+
+
+class AdmissionController:
+    """Bounded admission of expensive requests.
+
+    A request is admitted when both a worker slot is free and its estimated
+    memory cost fits into the remaining budget. Otherwise it waits in a FIFO
+    queue (up to max_queue entries and queue_timeout seconds) and is rejected
+    with AdmissionRejected when the queue is full or the wait times out.
+    """
+
+    def __init__(self, memory_budget_mb=2048, max_concurrent=4, max_queue=16, queue_timeout=30.0):
+        self.memory_budget_mb = float(memory_budget_mb)
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._in_flight = 0
+        self._memory_in_use = 0.0
+        self._publish()
+
+    def _fits(self, cost):
+        if self._in_flight >= self.max_concurrent:
+            return False
+        # An oversized request may still run, but only on an otherwise idle server
+        if self._in_flight == 0:
+            return True
+        return self._memory_in_use + cost <= self.memory_budget_mb
+
+    def _publish(self):
+        metrics.set_gauge('admission_in_flight', self._in_flight)
+        metrics.set_gauge('admission_queue_depth', len(self._waiting))
+        metrics.set_gauge('admission_memory_in_use_mb', round(self._memory_in_use, 1))
+        metrics.set_gauge('admission_memory_budget_mb', self.memory_budget_mb)
+
+    def _retry_after(self):
+        # Assume each queued request holds a slot for a few seconds
+        return max(1, int(2 * (len(self._waiting) + 1) / self.max_concurrent))
+
+    def acquire(self, cost_mb, pipeline='unknown'):
+        """Block until the request is admitted, or raise AdmissionRejected."""
+        ticket = object()
+        start = time.perf_counter()
+        with self._cond:
+            if not self._waiting and self._fits(cost_mb):
+                self._admit(cost_mb)
+                metrics.observe('admission_wait', 0.0)
+                return
+            if len(self._waiting) >= self.max_queue:
+                metrics.incr('admission_rejected_queue_full')
+                metrics.incr(f'admission_rejected.{pipeline}')
+                raise AdmissionRejected('Server is busy, queue is full', self._retry_after())
+            self._waiting.append(ticket)
+            metrics.incr('admission_queued')
+            self._publish()
+            deadline = start + self.queue_timeout
+            try:
+                while not (self._waiting[0] is ticket and self._fits(cost_mb)):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        metrics.incr('admission_rejected_timeout')
+                        metrics.incr(f'admission_rejected.{pipeline}')
+                        raise AdmissionRejected('Timed out waiting for capacity', self._retry_after())
+                    self._cond.wait(remaining)
+                self._waiting.popleft()
+                self._admit(cost_mb)
+            finally:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._publish()
+                # Let the next ticket re-check now that the head may have changed
+                self._cond.notify_all()
+        metrics.observe('admission_wait', time.perf_counter() - start)
+
+    def _admit(self, cost_mb):
+        self._in_flight += 1
+        self._memory_in_use += cost_mb
+        metrics.incr('admission_admitted')
+        self._publish()
+
+    def release(self, cost_mb):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._memory_in_use = max(0.0, self._memory_in_use - cost_mb)
+            self._publish()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost_mb, pipeline='unknown'):
+        """Context manager wrapping acquire()/release()."""
+        self.acquire(cost_mb, pipeline)
+        try:
+            yield
+        finally:
+            self.release(cost_mb)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'inFlight': self._in_flight,
+                'queueDepth': len(self._waiting),
+                'memoryInUseMb': round(self._memory_in_use, 1),
+                'memoryBudgetMb': self.memory_budget_mb,
+                'maxConcurrent': self.max_concurrent,
+                'maxQueue': self.max_queue,
+            }
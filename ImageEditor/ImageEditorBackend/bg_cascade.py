@@ -0,0 +1,101 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import metrics
+from bg_removal import predict_mask
+
+logger = logging.getLogger(__name__)
+
+# (model, long-side limit of the model input); cheapest first.
+# u2netp runs at 320x320 internally, so feeding it more pixels buys nothing.
+DEFAULT_STAGES = [
+    ('u2netp', 320),
+    ('isnet-general-use', None),
+]
+DEFAULT_CONFIDENCE_THRESHOLD = 0.75
+
+# Plausible foreground fraction for a cut-out subject
+_MIN_FOREGROUND = 0.02
+_MAX_FOREGROUND = 0.95
+
+
+def mask_confidence(mask: Image.Image) -> dict:
+    """Score how trustworthy a soft segmentation mask looks (0..1 per signal).
+
+    - bimodality: share of pixels that are clearly foreground or background
+    - sharpness: how thin the uncertain band is relative to the mask boundary
+    - foreground: penalises masks that are (nearly) empty or (nearly) full
+    """
+    alpha = np.asarray(mask.convert('L'), dtype=np.float32) / 255.0
+    if alpha.size == 0:
+        return {'score': 0.0, 'bimodality': 0.0, 'sharpness': 0.0, 'foreground': 0.0, 'foregroundFraction': 0.0}
+
+    uncertain = (alpha > 0.1) & (alpha < 0.9)
+    bimodality = 1.0 - float(uncertain.mean())
+
+    binary = (alpha > 0.5).astype(np.uint8)
+    fg_fraction = float(binary.mean())
+    edges = cv2.morphologyEx(binary, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    boundary = int(edges.sum())
+    if boundary == 0:
+        sharpness = 1.0 if _MIN_FOREGROUND <= fg_fraction <= _MAX_FOREGROUND else 0.0
+    else:
+        # A crisp edge keeps the uncertain band within ~2px of the boundary
+        band_width = uncertain.sum() / boundary
+        sharpness = float(np.clip(1.0 - (band_width - 2.0) / 8.0, 0.0, 1.0))
+
+    if fg_fraction < _MIN_FOREGROUND:
+        foreground = fg_fraction / _MIN_FOREGROUND
+    elif fg_fraction > _MAX_FOREGROUND:
+        foreground = max(0.0, (1.0 - fg_fraction) / (1.0 - _MAX_FOREGROUND))
+    else:
+        foreground = 1.0
+
+    score = foreground * (0.5 * sharpness + 0.5 * bimodality)
+    return {
+        'score': round(score, 4),
+        'bimodality': round(bimodality, 4),
+        'sharpness': round(sharpness, 4),
+        'foreground': round(foreground, 4),
+        'foregroundFraction': round(fg_fraction, 4),
+    }
+
+
+def run_cascade(image: Image.Image, get_session, stages=None, threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+    """Segment with the cheapest model first and escalate only when unsure.
+
+    Returns (mask, info) where mask is the accepted soft mask (possibly at the
+    reduced stage resolution; callers upscale it) and info describes the
+    stages that ran, their latency and confidence.
+    """
+    stages = stages or DEFAULT_STAGES
+    info = {'stages': [], 'model': None, 'escalated': False}
+    mask = None
+    for index, (model, max_side) in enumerate(stages):
+        start = time.perf_counter()
+        mask = predict_mask(image, get_session(model), max_side=max_side)
+        elapsed = time.perf_counter() - start
+        metrics.observe(f'cascade.stage.{model}', elapsed)
+        is_last = index == len(stages) - 1
+        confidence = None if is_last else mask_confidence(mask)
+        info['stages'].append({
+            'model': model,
+            'latencyMs': round(1000 * elapsed, 1),
+            'confidence': confidence,
+        })
+        info['model'] = model
+        if is_last or confidence['score'] >= threshold:
+            break
+        info['escalated'] = True
+        logger.info(f'Cascade: {model} confidence {confidence["score"]:.2f} < {threshold}, escalating')
+
+    metrics.incr('cascade.requests')
+    if info['escalated']:
+        metrics.incr('cascade.escalated')
+    metrics.set_gauge('cascade.escalation_rate',
+                      round(metrics.counter('cascade.escalated') / max(1, metrics.counter('cascade.requests')), 4))
+    return mask, info
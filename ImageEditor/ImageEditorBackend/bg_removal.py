@@ -0,0 +1,68 @@
+import base64
+import io
+import logging
+
+from PIL import Image
+from rembg import remove
+from rembg.bg import alpha_matting_cutout, naive_cutout
+
+logger = logging.getLogger(__name__)
+
+# Light model used for fast previews
+PREVIEW_MODEL = 'u2netp'
+
+
+def downscale(image: Image.Image, max_side) -> Image.Image:
+    """Return a copy no larger than max_side on its long edge (or the image itself)."""
+    if not max_side or max(image.size) <= max_side:
+        return image
+    ratio = max_side / max(image.size)
+    size = (max(1, round(image.size[0] * ratio)), max(1, round(image.size[1] * ratio)))
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+
+def predict_mask(image: Image.Image, session, max_side=None) -> Image.Image:
+    """Run the segmentation model and return its soft mask (mode 'L').
+
+    The model sees at most max_side pixels on the long edge, so the mask is
+    returned at that (possibly reduced) size.
+    """
+    return remove(downscale(image, max_side), session=session, only_mask=True)
+
+
+def cutout(image: Image.Image, mask: Image.Image, alpha_matting=False,
+           foreground_threshold=240, background_threshold=10, erode_size=10) -> Image.Image:
+    """Apply a mask (upscaled to the image if needed) and return an RGBA cutout."""
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.LANCZOS)
+    if alpha_matting:
+        try:
+            return alpha_matting_cutout(image, mask, foreground_threshold, background_threshold, erode_size)
+        except ValueError as e:
+            logger.warning(f'Alpha matting failed, using plain cutout: {e}')
+    return naive_cutout(image, mask)
+
+
+def remove_background(image: Image.Image, session, alpha_matting=False,
+                      foreground_threshold=240, background_threshold=10, erode_size=10) -> Image.Image:
+    """Full-quality background removal (same output as rembg.remove)."""
+    if alpha_matting:
+        return remove(
+            image,
+            session=session,
+            alpha_matting=True,
+            alpha_matting_foreground_threshold=foreground_threshold,
+            alpha_matting_background_threshold=background_threshold,
+            alpha_matting_erode_size=erode_size
+        )
+    return remove(image, session=session)
+
+
+def encode_png(image: Image.Image, optimize=False) -> bytes:
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format='PNG', optimize=optimize)
+    return img_bytes.getvalue()
+
+
+def png_data_url(image: Image.Image) -> str:
+    return 'data:image/png;base64,' + base64.b64encode(encode_png(image)).decode('utf-8')
@@ -0,0 +1,289 @@
+import logging
+import math
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+try:
+    import pypdfium2 as pdfium
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# EXIF orientations that swap width and height (transpose / rotate 90 / 270)
+_SWAPPED_ORIENTATIONS = {5, 6, 7, 8}
+_EXIF_ORIENTATION_TAG = 0x0112
+# Modes Pillow resamples properly; others (P, 1, I;16, CMYK, ...) are converted first
+_RESAMPLE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'I', 'F'}
+
+
+class ImageTooLarge(Exception):
+    """Raised when an upload exceeds the configured pixel limit."""
+
+
+class InvalidImage(Exception):
+    """Raised when an upload cannot be identified as an image."""
+
+
+class ImageHeader:
+    """Image metadata read without decoding pixel data.
+
+    width/height are the display size, i.e. after EXIF orientation.
+    """
+
+    def __init__(self, width, height, format, mode, orientation=1):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.mode = mode
+        self.orientation = orientation
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+
+class LoadedImage:
+    """A decoded image plus the information needed to map back to the upload.
+
+    scale is original_size / image.size (>= 1.0 when decoded smaller).
+    """
+
+    def __init__(self, image, original_size, header):
+        self.image = image
+        self.original_size = original_size
+        self.header = header
+
+    @property
+    def scale(self):
+        if not self.image.size[0]:
+            return 1.0
+        return self.original_size[0] / self.image.size[0]
+
+    @property
+    def downscaled(self):
+        return self.image.size != tuple(self.original_size)
+
+
+def _orientation(img: Image.Image) -> int:
+    try:
+        return int(img.getexif().get(_EXIF_ORIENTATION_TAG, 1))
+    except Exception:
+        return 1
+
+
+def _check_pixels(width, height, max_pixels):
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f'Image is {width}x{height} ({width * height} pixels), limit is {max_pixels} pixels')
+
+
+def _fit_size(size, max_side):
+    """size scaled so its long side is at most max_side, keeping the aspect ratio."""
+    if not max_side or max(size) <= max_side:
+        return tuple(size)
+    ratio = max_side / max(size)
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+
+def _resample_mode(img: Image.Image, mode: str) -> Image.Image:
+    """img in a mode that resize() handles, keeping transparency if it has any."""
+    if img.mode in _RESAMPLE_MODES:
+        return img
+    if img.mode in ('PA', 'La', 'RGBa') or 'transparency' in img.info:
+        return img.convert('RGBA')
+    return img.convert(mode if mode in _RESAMPLE_MODES else 'RGB')
+
+
+def read_image_header(stream, max_pixels: Optional[int] = None) -> ImageHeader:
+    """Identify the image and return its header. The stream is rewound afterwards."""
+    try:
+        with Image.open(stream) as img:
+            width, height = img.size
+            orientation = _orientation(img)
+            if orientation in _SWAPPED_ORIENTATIONS:
+                width, height = height, width
+            header = ImageHeader(width, height, img.format, img.mode, orientation)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception as e:
+        logger.info(f'Unidentified upload: {e}')
+        raise InvalidImage('Unsupported or corrupt image')
+    finally:
+        stream.seek(0)
+    _check_pixels(header.width, header.height, max_pixels)
+    return header
+
+
+def load_image(stream, mode: str = 'RGB', max_side: Optional[int] = None,
+               max_pixels: Optional[int] = None, flatten_alpha: bool = False) -> LoadedImage:
+    """Decode an uploaded image at (at most) the working resolution.
+
+    - The header is checked against max_pixels before any pixel is decoded.
+    - When max_side is set, the image is shrunk to exactly max_side on its
+      long edge: JPEGs are first decoded with draft mode (the largest DCT
+      scaling by 1/2, 1/4 or 1/8 that stays above the target), then resized
+      with LANCZOS (box-reduced first when far above the target). Palette,
+      1-bit and 16-bit images are converted before resampling.
+    - EXIF orientation is applied, so sizes match what browsers display.
+    - flatten_alpha composites RGBA input onto white when mode is 'RGB'.
+    """
+    header = read_image_header(stream, max_pixels)
+    try:
+        img = Image.open(stream)
+        # Orientation does not change the long side, so stored size is fine here
+        target = _fit_size(img.size, max_side)
+        if target != img.size:
+            # draft() never goes below the requested size, only to the nearest DCT scale above it
+            img.draft(None, target)
+        img.load()
+        if img.size != target:
+            img = _resample_mode(img, mode).resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        img = ImageOps.exif_transpose(img)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except (ImageTooLarge, InvalidImage):
+        raise
+    except Exception as e:
+        raise InvalidImage(f'Failed to decode image: {e}')
+
+    if flatten_alpha and mode == 'RGB' and img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    elif img.mode != mode:
+        img = img.convert(mode)
+
+    if img.size != (header.width, header.height):
+        logger.info(f'Decoded {header.width}x{header.height} upload at {img.size[0]}x{img.size[1]}')
+    return LoadedImage(img, (header.width, header.height), header)
+
+
+def downscale_for_analysis(image: Image.Image, max_side: Optional[int]) -> Tuple[Image.Image, float]:
+    """Return (image at most max_side on its long edge, scale back to the input)."""
+    if not max_side or max(image.size) <= max_side:
+        return image, 1.0
+    small = _resample_mode(image, image.mode).resize(_fit_size(image.size, max_side), Image.Resampling.LANCZOS,
+                                                     reducing_gap=3.0)
+    return small, image.size[0] / small.size[0]
+
+
+def scale_bbox(bbox: dict, scale: float) -> dict:
+    """Map a {x, y, width, height} bbox from a scaled image back to the original."""
+    if scale == 1.0:
+        return dict(bbox)
+    return {
+        'x': int(round(bbox.get('x', 0) * scale)),
+        'y': int(round(bbox.get('y', 0) * scale)),
+        'width': max(1, int(round(bbox.get('width', 0) * scale))),
+        'height': max(1, int(round(bbox.get('height', 0) * scale))),
+    }
+
+
+def is_pdf(stream) -> bool:
+    """True when the stream starts with a PDF signature. The stream is rewound."""
+    try:
+        return stream.read(5) == b'%PDF-'
+    finally:
+        stream.seek(0)
+
+
+def _pdf_render_scale(page, dpi, max_pixels):
+    width, height = page.get_size()  # PDF points (1/72 inch)
+    scale = dpi / 72.0
+    if max_pixels and width * height * scale * scale > max_pixels:
+        # Render oversized pages at the largest scale within the pixel limit
+        scale = math.sqrt(max_pixels / (width * height))
+    return scale
+
+
+def _open_pdf(stream):
+    if not PDF_AVAILABLE:
+        raise InvalidImage('PDF input requires pypdfium2 (pip install pypdfium2)')
+    try:
+        return pdfium.PdfDocument(stream.read())
+    except Exception as e:
+        logger.info(f'Unreadable PDF: {e}')
+        raise InvalidImage('Unsupported or corrupt PDF')
+    finally:
+        stream.seek(0)
+
+
+def read_document_header(stream, max_pixels: Optional[int] = None, pdf_dpi: int = 150) -> ImageHeader:
+    """Header of the first page of an image or PDF upload. The stream is rewound.
+
+    PDF pages are sized as rendered at pdf_dpi (capped to max_pixels).
+    """
+    if not is_pdf(stream):
+        return read_image_header(stream, max_pixels)
+    pdf = _open_pdf(stream)
+    try:
+        if len(pdf) == 0:
+            raise InvalidImage('PDF has no pages')
+        page = pdf[0]
+        scale = _pdf_render_scale(page, pdf_dpi, max_pixels)
+        width, height = page.get_size()
+        return ImageHeader(int(width * scale), int(height * scale), 'PDF', 'RGB')
+    finally:
+        pdf.close()
+
+
+def iter_document_pages(stream, mode: str = 'RGB', max_pixels: Optional[int] = None,
+                        max_pages: Optional[int] = None, pdf_dpi: int = 150):
+    """Yield (page_index, image) for each page of a multi-page TIFF, PDF or image.
+
+    Pages are decoded lazily, one at a time, so memory is bounded by the
+    pages the caller keeps alive rather than the document length. PDFs
+    need pypdfium2 and are rendered at pdf_dpi. Single-page images yield
+    one page. Stops after max_pages pages.
+    """
+    if is_pdf(stream):
+        yield from _iter_pdf_pages(stream, mode, max_pixels, max_pages, pdf_dpi)
+        return
+
+    read_image_header(stream, max_pixels)
+    try:
+        img = Image.open(stream)
+        page_count = getattr(img, 'n_frames', 1)
+    except Exception as e:
+        logger.info(f'Unidentified upload: {e}')
+        raise InvalidImage('Unsupported or corrupt image')
+    if max_pages:
+        page_count = min(page_count, max_pages)
+    try:
+        for index in range(page_count):
+            try:
+                img.seek(index)
+                _check_pixels(img.size[0], img.size[1], max_pixels)
+                # exif_transpose returns a copy when it rotates; convert() always
+                # copies, so the yielded page does not share the decoder frame
+                page = ImageOps.exif_transpose(img)
+                page = page.convert(mode) if page.mode != mode or page is img else page
+            except ImageTooLarge:
+                raise
+            except Exception as e:
+                raise InvalidImage(f'Failed to decode page {index + 1}: {e}')
+            yield index, page
+    finally:
+        img.close()
+
+
+def _iter_pdf_pages(stream, mode, max_pixels, max_pages, pdf_dpi):
+    pdf = _open_pdf(stream)
+    try:
+        page_count = len(pdf)
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        for index in range(page_count):
+            page = pdf[index]
+            try:
+                bitmap = page.render(scale=_pdf_render_scale(page, pdf_dpi, max_pixels))
+                image = bitmap.to_pil()
+            except Exception as e:
+                raise InvalidImage(f'Failed to render page {index + 1}: {e}')
+            finally:
+                page.close()
+            yield index, image.convert(mode) if image.mode != mode else image
+    finally:
+        pdf.close()
@@ -3,6 +3,8 @@ import numpy as np
 from PIL import Image
 import logging
 
+from inpainting import inpaint_text_regions
+
 logger = logging.getLogger(__name__)
 
 def extract_text_with_ocr(image, tesseract_available):
@@ -10,12 +12,18 @@ def extract_text_with_ocr(image, tesseract_available):
     if not tesseract_available:
         return {"words": [], "full_text": ""}
     
+    # Preprocess image for better OCR
+    processed_img, scale_factor = preprocess_image_for_ocr(image)
+    return extract_text_from_preprocessed(processed_img, scale_factor, tesseract_available)
+
+def extract_text_from_preprocessed(processed_img, scale_factor, tesseract_available):
+    """Run OCR on an image already passed through preprocess_image_for_ocr."""
+    if not tesseract_available:
+        return {"words": [], "full_text": ""}
+    
     try:
         import pytesseract
         
-        # Preprocess image for better OCR
-        processed_img, scale_factor = preprocess_image_for_ocr(image)
-        
         # Get detailed OCR data
         data = pytesseract.image_to_data(processed_img, output_type=pytesseract.Output.DICT)
         
@@ -167,22 +175,26 @@ def preprocess_image_for_ocr(image):
 
 
 # --- Smart Text Replacement Mask ---
-def erase_text_regions(image: Image.Image, words, method: str = "fill") -> Image.Image:
+def erase_text_regions(image: Image.Image, words, method: str = "fill", executor=None) -> Image.Image:
     """Erase/clean detected text regions without affecting the rest of the image.
 
     Args:
         image: PIL.Image in RGB mode (coordinates relate to this image size)
         words: iterable of dicts with structure { 'bbox': {x,y,width,height}, 'text': str, ... }
-        method: 'fill' (average color) or 'blur' (Gaussian blur)
+        method: 'fill' (average color), 'blur' (Gaussian blur), 'inpaint' (TELEA)
+            or 'inpaint_hq' (inpaints only the glyph pixels, see inpainting.py)
+        executor: optional thread pool for inpainting independent regions in parallel
 
     Returns:
         PIL.Image with text regions replaced/blurred
     """
     try:
         img = np.array(image.convert('RGB'))
+        if method in ('inpaint', 'inpaint_hq'):
+            # Inpaint padded crops around clustered boxes instead of the full frame
+            inpaint_text_regions(img, words, radius=3, executor=executor, high_quality=method == 'inpaint_hq')
+            return Image.fromarray(img)
         h, w, _ = img.shape
-        # Prepare mask for inpainting if needed
-        mask = np.zeros((h, w), dtype=np.uint8)
         for wobj in words or []:
             bbox = wobj.get('bbox') or {}
             x = int(max(0, bbox.get('x', 0)))
@@ -198,17 +210,9 @@ def erase_text_regions(image: Image.Image, words, method: str = "fill") -> Image
                 # Ensure odd kernel sizes and within ROI bounds
                 k = 15 if min(roi.shape[0], roi.shape[1]) >= 15 else max(3, (min(roi.shape[0], roi.shape[1]) // 2) * 2 + 1)
                 img[y:y2, x:x2] = cv2.GaussianBlur(roi, (k, k), 0)
-            elif method == 'inpaint':
-                mask[y:y2, x:x2] = 255
             else:
                 avg_color = cv2.mean(roi)[:3]
                 img[y:y2, x:x2] = avg_color
-        if method == 'inpaint':
-            # Slightly dilate to cover edges
-            kernel = np.ones((3,3), np.uint8)
-            dilated = cv2.dilate(mask, kernel, iterations=1)
-            inpainted = cv2.inpaint(img, dilated, 3, cv2.INPAINT_TELEA)
-            return Image.fromarray(inpainted)
         return Image.fromarray(img)
     except Exception as e:
         logger.error(f'erase_text_regions error: {e}')
@@ -245,35 +249,100 @@ def group_words_into_lines(words, y_tolerance_ratio: float = 0.5):
     return lines
 
 
+def _hex(rgb) -> str:
+    r, g, b = (int(round(float(c))) for c in rgb)
+    return '#%02x%02x%02x' % (r, g, b)
+
+
+def _box_grid(starts, ends, n):
+    """n evenly spaced integer positions in [start, end) for every box (shape N x n)."""
+    t = (np.arange(n, dtype=np.float32) + 0.5) / n
+    span = (ends - starts).astype(np.float32)[:, None]
+    return (starts[:, None] + t[None, :] * span).astype(np.intp)
+
+
+def estimate_line_colors(image: Image.Image, bboxes, grid: int = 16, ring_samples: int = 32,
+                         ring_pad: int = 3, iterations: int = 6, min_contrast: float = 24.0):
+    """Estimate text and background colors for many boxes in one vectorized pass.
+
+    The image is converted once. Each box contributes a fixed grid x grid
+    sample of its pixels plus ring_samples pixels from a ring just outside
+    it, so cost is independent of box size. A batched 2-means splits each
+    box's samples into two colors; the cluster closer to the surrounding
+    ring is the background and the other one is the text. Boxes with no
+    real contrast get black or white text, whichever reads on the background.
+
+    Returns a list of {'text': hex, 'background': hex} in bbox order.
+    """
+    if not bboxes:
+        return []
+    img = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+    h, w, _ = img.shape
+
+    boxes = np.array([[b.get('x', 0), b.get('y', 0), b.get('width', 1), b.get('height', 1)] for b in bboxes],
+                     dtype=np.float64).astype(np.intp)
+    x1 = np.clip(boxes[:, 0], 0, w - 1)
+    y1 = np.clip(boxes[:, 1], 0, h - 1)
+    x2 = np.clip(boxes[:, 0] + np.maximum(1, boxes[:, 2]), x1 + 1, w)
+    y2 = np.clip(boxes[:, 1] + np.maximum(1, boxes[:, 3]), y1 + 1, h)
+
+    # Inner samples: (N, grid * grid, 3)
+    ys = _box_grid(y1, y2, grid)
+    xs = _box_grid(x1, x2, grid)
+    inner = img[ys[:, :, None], xs[:, None, :]].reshape(len(boxes), grid * grid, 3).astype(np.float32)
+
+    # Ring samples along the perimeter of the box grown by ring_pad: (N, ring_samples, 3)
+    rx1, ry1 = np.maximum(0, x1 - ring_pad), np.maximum(0, y1 - ring_pad)
+    rx2, ry2 = np.minimum(w - 1, x2 - 1 + ring_pad), np.minimum(h - 1, y2 - 1 + ring_pad)
+    side = ring_samples // 4
+    ring_x = np.concatenate([_box_grid(rx1, rx2 + 1, side), _box_grid(rx1, rx2 + 1, side),
+                             np.repeat(rx1[:, None], side, 1), np.repeat(rx2[:, None], side, 1)], axis=1)
+    ring_y = np.concatenate([np.repeat(ry1[:, None], side, 1), np.repeat(ry2[:, None], side, 1),
+                             _box_grid(ry1, ry2 + 1, side), _box_grid(ry1, ry2 + 1, side)], axis=1)
+    ring = img[ring_y, ring_x].astype(np.float32)
+    ring_color = np.median(ring, axis=1)
+
+    # Batched 2-means, seeded with the darkest and brightest sample of each box
+    luma = inner @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    rows = np.arange(len(boxes))
+    centers = np.stack([inner[rows, luma.argmin(1)], inner[rows, luma.argmax(1)]], axis=1)  # (N, 2, 3)
+    for _ in range(iterations):
+        dist = ((inner[:, :, None, :] - centers[:, None, :, :]) ** 2).sum(-1)  # (N, S, 2)
+        assign = dist.argmin(-1)
+        for k in range(2):
+            member = (assign == k)[..., None]
+            count = member.sum(1)
+            sums = (inner * member).sum(1)
+            centers[:, k] = np.where(count > 0, sums / np.maximum(count, 1), centers[:, k])
+
+    # Background: the cluster that matches the surroundings; text: the other one
+    ring_dist = ((centers - ring_color[:, None, :]) ** 2).sum(-1)
+    bg_index = ring_dist.argmin(1)
+    background = centers[rows, bg_index]
+    text = centers[rows, 1 - bg_index]
+
+    contrast = np.sqrt(((text - background) ** 2).sum(-1))
+    bg_luma = background @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    fallback = np.where(bg_luma[:, None] > 127, 0.0, 255.0) * np.ones((1, 3), dtype=np.float32)
+    text = np.where((contrast < min_contrast)[:, None], fallback, text)
+
+    return [{'text': _hex(t), 'background': _hex(b)} for t, b in zip(text, background)]
+
+
 def estimate_text_color_near_bbox(image: Image.Image, bbox: dict) -> str:
-    """Estimate foreground text color by sampling inside bbox and around edges.
+    """Estimate foreground text color for a single bbox.
 
-    Returns hex color string.
+    Returns hex color string. Prefer estimate_line_colors for many boxes.
     """
     try:
-        img = np.array(image.convert('RGB'))
-        h, w, _ = img.shape
-        x = int(max(0, bbox.get('x', 0)))
-        y = int(max(0, bbox.get('y', 0)))
-        bw = int(max(1, bbox.get('width', 1)))
-        bh = int(max(1, bbox.get('height', 1)))
-        x2 = min(w, x + bw)
-        y2 = min(h, y + bh)
-        # core region (likely text)
-        core = img[y:y2, x:x2]
-        if core.size == 0:
-            return '#000000'
-        # Use median to be robust
-        med = np.median(core.reshape(-1, 3), axis=0)
-        r, g, b = int(med[0]), int(med[1]), int(med[2])
-        return '#%02x%02x%02x' % (r, g, b)
+        return estimate_line_colors(image, [bbox])[0]['text']
     except Exception:
         return '#000000'
 
 
 def build_fabric_text_objects_from_lines(image: Image.Image, lines):
     """Create Fabric.js-ready textbox objects for each line with styling."""
-    objects = []
+    candidates = []
     for line in lines:
         if not line:
             continue
@@ -286,14 +355,21 @@ def build_fabric_text_objects_from_lines(image: Image.Image, lines):
         max_x = int(last.get('x', 0) + last.get('width', 0))
         min_y = int(min(w['bbox'].get('y', 0) for w in line))
         max_h = int(max(w['bbox'].get('height', 16) for w in line))
+        candidates.append((text, min_x, max_x, min_y, max_h))
+
+    # estimate colors for all combined line bboxes at once
+    try:
+        colors = estimate_line_colors(image, [
+            {'x': min_x, 'y': min_y, 'width': max(1, max_x - min_x), 'height': max_h}
+            for _, min_x, max_x, min_y, max_h in candidates
+        ])
+    except Exception as e:
+        logger.warning(f'Text color estimation failed: {e}')
+        colors = [{'text': '#000000', 'background': '#ffffff'}] * len(candidates)
+
+    objects = []
+    for (text, min_x, max_x, min_y, max_h), color in zip(candidates, colors):
         font_size = max(12, int(round(max_h * 0.9)))
-        # estimate color from the combined line bbox
-        color = estimate_text_color_near_bbox(image, {
-            'x': min_x,
-            'y': min_y,
-            'width': max(1, max_x - min_x),
-            'height': max_h
-        })
         objects.append({
             'type': 'textbox',
             'text': text,
@@ -301,7 +377,9 @@ def build_fabric_text_objects_from_lines(image: Image.Image, lines):
             'top': min_y,
             'width': max(60, max_x - min_x),
             'fontSize': font_size,
-            'fill': color,
+            'fill': color['text'],
+            # Color sampled around the text; not Fabric's backgroundColor so the box stays transparent
+            'sampledBackground': color['background'],
             'fontFamily': 'Arial',
             'name': f'Text: {text[:30]}'
         })
@@ -356,7 +434,13 @@ def rectify_image_for_ocr(image: Image.Image):
     """If a document quad is detected, warp to a rectified top-down view.
     Returns (rectified_image, H, H_inv). If not possible, returns (image, None, None).
     """
-    quad = detect_document_quad(image)
+    return warp_to_quad(image, detect_document_quad(image))
+
+
+def warp_to_quad(image: Image.Image, quad):
+    """Warp image so the detected quad becomes a top-down rectangle.
+    Returns (rectified_image, H, H_inv), or (image, None, None) without a quad.
+    """
     if quad is None:
         return image, None, None
     try:
@@ -403,7 +487,11 @@ def ocr_with_rectification(image: Image.Image, tesseract_available: bool):
     data = extract_text_with_ocr(rectified, tesseract_available)
     if H_inv is None:
         return data, None, None
-    # Map each bbox back
+    return map_words_to_original(data, H_inv), H, H_inv
+
+
+def map_words_to_original(data: dict, H_inv: np.ndarray) -> dict:
+    """Map OCR word boxes found on a rectified image back to the original."""
     mapped_words = []
     for w in data.get('words', []):
         bbox = _apply_homography_to_bbox(w.get('bbox', {}), H_inv)
@@ -412,4 +500,4 @@ def ocr_with_rectification(image: Image.Image, tesseract_available: bool):
             'confidence': w.get('confidence', 0),
             'bbox': bbox
         })
-    return {'words': mapped_words, 'full_text': data.get('full_text', '')}, H, H_inv
\ No newline at end of file
+    return {'words': mapped_words, 'full_text': data.get('full_text', '')}
\ No newline at end of file
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+# Simple in-process metrics registry shared by all request handlers.
+# Counters only go up, gauges hold the latest value and timings keep a
+# bounded window of recent samples for percentile reporting.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+TIMING_WINDOW = 512
+
+
+def incr(name, value=1):
+    """Increase a counter by value."""
+    with _lock:
+        _counters[name] += value
+
+
+def counter(name):
+    """Current value of a counter (0 if never incremented)."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name, value):
+    """Record the current value of a gauge."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    """Record a duration sample (in seconds) for a timing metric."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = {'count': 0, 'total': 0.0, 'max': 0.0, 'recent': deque(maxlen=TIMING_WINDOW)}
+            _timings[name] = timing
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['recent'].append(seconds)
+
+
+class timed:
+    """Context manager that records the elapsed time of its block."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def process_rss_bytes():
+    """Best-effort resident set size of this process in bytes (0 if unknown)."""
+    try:
+        import os
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import resource
+        import sys
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except Exception:
+        return 0
+
+
+def snapshot():
+    """Return a JSON-serialisable copy of all metrics."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {}
+        for name, timing in _timings.items():
+            recent = sorted(timing['recent'])
+            timings[name] = {
+                'count': timing['count'],
+                'avgMs': round(1000 * timing['total'] / timing['count'], 2) if timing['count'] else 0.0,
+                'maxMs': round(1000 * timing['max'], 2),
+                'p50Ms': round(1000 * _percentile(recent, 50), 2),
+                'p95Ms': round(1000 * _percentile(recent, 95), 2),
+            }
+    gauges['process_rss_bytes'] = process_rss_bytes()
+    return {'counters': counters, 'gauges': gauges, 'timings': timings}
+
+
+def reset():
+    """Clear all metrics (mainly useful for local experiments)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+
+from rembg import new_session
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('fp32', 'int8')
+# Deployment-wide default; requests may override it with a `precision` field
+DEFAULT_PRECISION = os.environ.get('MODEL_PRECISION', 'fp32').lower()
+QUANTIZED_MODEL_DIR = os.path.expanduser(os.environ.get(
+    'QUANTIZED_MODEL_DIR',
+    os.path.join(os.getenv('U2NET_HOME', os.path.join('~', '.u2net')), 'quantized'),
+))
+
+# Session pooling for better performance - reuse models instead of recreating
+_sessions = {}
+_session_lock = threading.Lock()
+_missing_warned = set()
+
+
+def quantized_model_paths(model_name, precision='int8', model_dir=None):
+    """File(s) holding the quantized graph(s) for a model.
+
+    SAM is an encoder/decoder pair; every other model is a single graph.
+    """
+    model_dir = model_dir or QUANTIZED_MODEL_DIR
+    if model_name == 'sam':
+        return [os.path.join(model_dir, f'sam.encoder.{precision}.onnx'),
+                os.path.join(model_dir, f'sam.decoder.{precision}.onnx')]
+    return [os.path.join(model_dir, f'{model_name}.{precision}.onnx')]
+
+
+def has_quantized_variant(model_name, precision='int8'):
+    return all(os.path.exists(p) for p in quantized_model_paths(model_name, precision))
+
+
+def session_class(model_name):
+    """The rembg session class registered under model_name."""
+    from rembg.sessions import sessions_class
+    for candidate in sessions_class:
+        if candidate.name() == model_name:
+            return candidate
+    raise ValueError(f'No session class found for model {model_name!r}')
+
+
+def new_quantized_session(model_name, paths):
+    """Create a rembg session for `model_name` backed by quantized ONNX file(s).
+
+    The model's own session class is reused so pre- and post-processing are
+    identical to FP32; only the graph it loads is swapped.
+    """
+    import onnxruntime as ort
+
+    base_class = session_class(model_name)
+    resolved = paths if model_name == 'sam' else paths[0]
+    quantized_class = type(f'{base_class.__name__}Quantized', (base_class,), {
+        'download_models': classmethod(lambda cls, *args, **kwargs: resolved),
+    })
+    return quantized_class(model_name, ort.SessionOptions())
+
+
+def resolve_precision(precision=None):
+    precision = (precision or DEFAULT_PRECISION).lower()
+    return precision if precision in PRECISIONS else 'fp32'
+
+
+def available_precision(model_name, precision=None):
+    """The precision get_session actually loads for model_name.
+
+    INT8 without a quantized file falls back to FP32; report this rather
+    than the requested precision.
+    """
+    precision = resolve_precision(precision)
+    if precision != 'fp32' and not has_quantized_variant(model_name, precision):
+        return 'fp32'
+    return precision
+
+
+def get_session(model_name='isnet-general-use', precision=None):
+    """Get or create a rembg session for the specified model and precision.
+
+    INT8 falls back to FP32 (with a warning) when no quantized file exists;
+    see tools/quantize_models.py for producing them.
+    """
+    requested = resolve_precision(precision)
+    precision = available_precision(model_name, requested)
+    if precision != requested:
+        if (model_name, requested) not in _missing_warned:
+            _missing_warned.add((model_name, requested))
+            logger.warning(f'No {requested} variant of {model_name} in {QUANTIZED_MODEL_DIR}, using fp32')
+        metrics.incr(f'model_precision_fallback.{model_name}')
+
+    key = (model_name, precision)
+    with _session_lock:
+        if key not in _sessions:
+            logger.info(f'Initializing model: {model_name} ({precision})')
+            # Use ISNet General Use model for better precision (more accurate than u2net)
+            # Alternative models: 'u2net', 'u2net_human_seg', 'u2netp', 'silueta', 'isnet-general-use', 'sam'
+            if precision == 'fp32':
+                _sessions[key] = new_session(model_name)
+            else:
+                _sessions[key] = new_quantized_session(model_name, quantized_model_paths(model_name, precision))
+            logger.info(f'Model {model_name} ({precision}) initialized successfully')
+        return _sessions[key]
+
+
+def loaded_models():
+    with _session_lock:
+        return [{'model': model, 'precision': precision} for model, precision in _sessions]
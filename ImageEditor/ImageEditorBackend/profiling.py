@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Threads currently being profiled: thread ident -> Profile, and the stage
+# stack of each of those threads. Both are empty unless a profile is running,
+# which is what keeps stage() free when profiling is off.
+_thread_profiles = {}
+_thread_stages = {}
+_lock = threading.Lock()
+
+# <local timestamp with milliseconds>-<random>, so ids sort by start time
+_PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{9}-[0-9a-f]{8}$')
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name, profile, stages):
+        self.name = name
+        self.profile = profile
+        self.stages = stages
+        self.start = None
+
+    def __enter__(self):
+        self.stages.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profile.add_stage_time('/'.join(self.stages), time.perf_counter() - self.start)
+        self.stages.pop()
+        return False
+
+
+def stage(name):
+    """Tag samples taken inside the block with a pipeline stage name.
+
+    A no-op (one dict lookup) unless the calling thread is being profiled.
+    """
+    if not _thread_profiles:
+        return _NULL_STAGE
+    ident = threading.get_ident()
+    profile = _thread_profiles.get(ident)
+    if profile is None:
+        return _NULL_STAGE
+    return _Stage(name, profile, _thread_stages[ident])
+
+
+def bind(fn):
+    """Wrap fn so a worker thread running it joins the caller's profile.
+
+    Returns fn unchanged when the calling thread is not being profiled.
+    """
+    if not _thread_profiles:
+        return fn
+    profile = _thread_profiles.get(threading.get_ident())
+    if profile is None:
+        return fn
+    stages = list(_thread_stages.get(threading.get_ident(), []))
+
+    def bound(*args, **kwargs):
+        ident = threading.get_ident()
+        profile.attach(ident, stages)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.detach(ident)
+    return bound
+
+
+class Profile:
+    """Wall-clock sampling profile of the threads attached to it.
+
+    A daemon thread reads sys._current_frames() every `interval` seconds and
+    counts each attached thread's stack, prefixed with its current stage tags.
+    Sampling stops after max_seconds even if the request is still running.
+    """
+
+    def __init__(self, name, interval=0.005, max_seconds=60.0):
+        self.name = name
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.stage_times = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        millis = int(self.started_at * 1000) % 1000
+        self.id = time.strftime('%Y%m%dT%H%M%S', time.localtime(self.started_at)) + f'{millis:03d}-{uuid.uuid4().hex[:8]}'
+        self.duration = None
+        self._start = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f'profiler-{self.id}', daemon=True)
+
+    def attach(self, ident, stages=None):
+        with _lock:
+            _thread_profiles[ident] = self
+            _thread_stages[ident] = list(stages or [])
+
+    def detach(self, ident):
+        with _lock:
+            if _thread_profiles.get(ident) is self:
+                del _thread_profiles[ident]
+                _thread_stages.pop(ident, None)
+
+    def add_stage_time(self, name, seconds):
+        with _lock:
+            self.stage_times[name] += seconds
+
+    def start(self):
+        self._start = time.perf_counter()
+        self.attach(threading.get_ident())
+        self._sampler.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and detach every thread still attached."""
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._start
+        with _lock:
+            for ident in [i for i, p in _thread_profiles.items() if p is self]:
+                del _thread_profiles[ident]
+                _thread_stages.pop(ident, None)
+        return self
+
+    def _run(self):
+        deadline = self._start + self.max_seconds
+        while not self._stop.wait(self.interval):
+            if time.perf_counter() > deadline:
+                logger.warning(f'Profile {self.id} hit the {self.max_seconds}s limit, sampling stopped')
+                return
+            self._sample()
+
+    def _sample(self):
+        with _lock:
+            threads = [(ident, list(_thread_stages.get(ident, [])))
+                       for ident, profile in _thread_profiles.items() if profile is self]
+        frames = sys._current_frames()
+        for ident, stages in threads:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack.reverse()
+            root = [f'[{name}]' for name in stages] or ['[untagged]']
+            self.stacks[';'.join([self.name] + root + stack)] += 1
+            self.samples += 1
+        del frames
+
+    def collapsed(self):
+        """Folded stacks ("frame;frame;... count" per line), as read by flamegraph.pl and speedscope."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'startedAt': self.started_at,
+            'durationMs': round(1000 * (self.duration or 0.0), 1),
+            'samples': self.samples,
+            'intervalMs': round(1000 * self.interval, 2),
+            'stagesMs': {name: round(1000 * seconds, 1) for name, seconds in self.stage_times.items()},
+        }
+
+
+class ProfileStore:
+    """Keeps the newest max_count profiles on disk as .collapsed + .json pairs."""
+
+    def __init__(self, directory, max_count=20):
+        self.directory = directory
+        self.max_count = max(1, int(max_count))
+        self._lock = threading.Lock()
+        self._armed = 0
+
+    def arm(self, count):
+        """Profile the next `count` requests without a request header."""
+        with self._lock:
+            self._armed = max(0, int(count))
+
+    def take_armed(self):
+        with self._lock:
+            if self._armed <= 0:
+                return False
+            self._armed -= 1
+            return True
+
+    @property
+    def armed(self):
+        return self._armed
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'{profile.id}.collapsed'), 'w') as f:
+            f.write(profile.collapsed())
+        with open(os.path.join(self.directory, f'{profile.id}.json'), 'w') as f:
+            json.dump(profile.summary(), f)
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            ids = sorted(self._ids())
+            for profile_id in ids[:-self.max_count]:
+                for ext in ('.collapsed', '.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + ext))
+                    except FileNotFoundError:
+                        pass
+
+    def _ids(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name[:-5] for name in os.listdir(self.directory)
+                if name.endswith('.json') and _PROFILE_ID.match(name[:-5])]
+
+    def list(self):
+        """Summaries of stored profiles, newest first."""
+        summaries = []
+        for profile_id in sorted(self._ids(), reverse=True):
+            try:
+                with open(os.path.join(self.directory, f'{profile_id}.json')) as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return summaries
+
+    def collapsed_path(self, profile_id):
+        """Path of a stored profile, or None for unknown or malformed ids."""
+        if not _PROFILE_ID.match(profile_id or ''):
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.collapsed')
+        return path if os.path.isfile(path) else None
@@ -1,12 +1,30 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify
 from flask_cors import CORS
-from rembg import remove, new_session
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from image_processing import extract_text_with_ocr as ocr_extract, segment_objects_with_methods as segment_objects
 from image_processing import erase_text_regions, group_words_into_lines, build_fabric_text_objects_from_lines
-from image_processing import ocr_with_rectification
+from image_processing import preprocess_image_for_ocr, extract_text_from_preprocessed
+from image_processing import detect_document_quad, warp_to_quad, map_words_to_original
+from admission import AdmissionController, AdmissionRejected, RESTORE_BYTES_PER_PIXEL, estimate_cost_mb
+from singleflight import Group, request_key
+from model_registry import get_session, available_precision, resolve_precision, loaded_models
+from bg_removal import PREVIEW_MODEL, downscale, predict_mask, cutout, remove_background, png_data_url
+from bg_cascade import DEFAULT_STAGES, run_cascade
+from image_ingest import ImageTooLarge, InvalidImage, read_image_header, load_image, downscale_for_analysis, scale_bbox
+from image_ingest import read_document_header, iter_document_pages
+from video_matting import MaskPropagator, iter_video_frames
+from profiling import Profile, ProfileStore, bind, stage
+from stage_graph import StageGraph
+from text_compositor import TextCompositor, parse_text_edit
+from traffic_capture import TrafficRecorder
+import metrics
+import functools
+import hmac
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import io
-import threading
+import time
 import logging
 import cv2
 import numpy as np
@@ -21,6 +39,101 @@ CORS(app)  # Allow requests from your Fabric.js frontend
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Serving / admission configuration (see "Production Serving" in the docs)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'development').lower()
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', min(4, os.cpu_count() or 1)))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '16'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '30'))
+ADMISSION_MEMORY_BUDGET_MB = float(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', '2048'))
+
+# Upload limits and per-pipeline working resolution (0 disables a limit)
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+REMOVE_BG_MAX_SIDE = int(os.environ.get('REMOVE_BG_MAX_SIDE', '4096'))
+MAKE_EDITABLE_OCR_MAX_SIDE = int(os.environ.get('MAKE_EDITABLE_OCR_MAX_SIDE', '2400'))
+
+# Coalesce identical concurrent /remove-bg and /make-editable requests
+SINGLEFLIGHT_ENABLED = os.environ.get('SINGLEFLIGHT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Progressive /remove-bg: long side of the quick u2netp preview
+PREVIEW_MAX_SIDE = int(os.environ.get('PREVIEW_MAX_SIDE', '512'))
+
+# model=auto cascade: accept the cheap u2netp mask above this confidence,
+# otherwise escalate to CASCADE_ESCALATION_MODEL
+CASCADE_CONFIDENCE_THRESHOLD = float(os.environ.get('CASCADE_CONFIDENCE_THRESHOLD', '0.75'))
+CASCADE_STAGES = [DEFAULT_STAGES[0], (os.environ.get('CASCADE_ESCALATION_MODEL', 'isnet-general-use'), None)]
+
+# /remove-bg/video: frames are processed at most VIDEO_MAX_SIDE on the long side.
+# A server-side video_path is only accepted inside VIDEO_INPUT_DIR (unset = disabled).
+VIDEO_MAX_SIDE = int(os.environ.get('VIDEO_MAX_SIDE', '1280'))
+VIDEO_INPUT_DIR = os.environ.get('VIDEO_INPUT_DIR')
+VIDEO_KEYFRAME_INTERVAL = int(os.environ.get('VIDEO_KEYFRAME_INTERVAL', '12'))
+
+# /make-editable/document: pages are OCR'd on a shared worker pool; each request
+# keeps at most DOCUMENT_PAGES_IN_FLIGHT decoded pages alive at once
+DOCUMENT_PAGE_WORKERS = int(os.environ.get('DOCUMENT_PAGE_WORKERS', min(4, os.cpu_count() or 1)))
+DOCUMENT_PAGES_IN_FLIGHT = int(os.environ.get('DOCUMENT_PAGES_IN_FLIGHT', DOCUMENT_PAGE_WORKERS))
+DOCUMENT_MAX_PAGES = int(os.environ.get('DOCUMENT_MAX_PAGES', '200'))
+DOCUMENT_PDF_DPI = int(os.environ.get('DOCUMENT_PDF_DPI', '150'))
+
+# Threads running independent /make-editable stages (shared by all requests).
+# Speculative OCR preprocessing only pays off with a spare core to run it on.
+STAGE_WORKERS = int(os.environ.get('STAGE_WORKERS', 2 * max(ADMISSION_MAX_CONCURRENT, DOCUMENT_PAGE_WORKERS)))
+# Threads inpainting independent text regions (text_clean_method=inpaint)
+INPAINT_WORKERS = int(os.environ.get('INPAINT_WORKERS', min(4, os.cpu_count() or 1)))
+SPECULATIVE_OCR = os.environ.get('SPECULATIVE_OCR', 'true' if (os.cpu_count() or 1) > 1 else 'false').lower() in ('1', 'true', 'yes')
+
+# /integrate-text caches base images with their last composite (two full-size
+# copies each) and rendered text layers, LRU within these budgets. Both live
+# outside ADMISSION_MEMORY_BUDGET_MB, so leave room for them.
+COMPOSITOR_BASE_CACHE_MB = int(os.environ.get('COMPOSITOR_BASE_CACHE_MB', '256'))
+COMPOSITOR_LAYER_CACHE_MB = int(os.environ.get('COMPOSITOR_LAYER_CACHE_MB', '64'))
+
+# Traffic capture for tools/replay_traffic.py: one anonymised JSON line per
+# request; payloads (uploads, textEdits) are only kept when asked for
+TRAFFIC_CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH')
+TRAFFIC_CAPTURE_PAYLOADS = os.environ.get('TRAFFIC_CAPTURE_PAYLOADS', 'false').lower() in ('1', 'true', 'yes')
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', '1.0'))
+
+# Reject oversized bodies from Content-Length before the upload is parsed
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES or None
+if MAX_IMAGE_PIXELS:
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# On-demand profiling: requests with `X-Profile: 1` and a matching
+# X-Admin-Token are sampled; ADMIN_TOKEN unset disables profiling and /admin
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), '3yuga-profiles'))
+PROFILE_MAX_COUNT = int(os.environ.get('PROFILE_MAX_COUNT', '20'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+
+admission_controller = AdmissionController(
+    memory_budget_mb=ADMISSION_MEMORY_BUDGET_MB,
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+)
+
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_MAX_COUNT)
+
+page_executor = ThreadPoolExecutor(max_workers=max(1, DOCUMENT_PAGE_WORKERS), thread_name_prefix='document-page')
+# Separate from page_executor: page workers block on their stages
+stage_executor = ThreadPoolExecutor(max_workers=max(2, STAGE_WORKERS), thread_name_prefix='make-editable-stage')
+# Own pool again: the erase stage waits on its regions from a stage worker
+inpaint_executor = ThreadPoolExecutor(max_workers=max(1, INPAINT_WORKERS), thread_name_prefix='inpaint')
+
+text_compositor = TextCompositor(max_base_bytes=COMPOSITOR_BASE_CACHE_MB * 1024 * 1024,
+                                 max_layer_bytes=COMPOSITOR_LAYER_CACHE_MB * 1024 * 1024)
+
+traffic_recorder = None
+if TRAFFIC_CAPTURE_PATH:
+    traffic_recorder = TrafficRecorder(
+        TRAFFIC_CAPTURE_PATH,
+        payload_dir=f'{TRAFFIC_CAPTURE_PATH}.payloads' if TRAFFIC_CAPTURE_PAYLOADS else None,
+        sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE,
+    )
+
 try:
     import pytesseract
     TESSERACT_AVAILABLE = True
@@ -77,20 +190,7 @@ except ImportError:
     TESSERACT_AVAILABLE = False
     logger.warning("pytesseract not available. OCR features will be disabled.")
 
-# Session pooling for better performance - reuse models instead of recreating
-_sessions = {}
-_session_lock = threading.Lock()
-
-def get_session(model_name='isnet-general-use'):
-    """Get or create a rembg session for the specified model."""
-    with _session_lock:
-        if model_name not in _sessions:
-            logger.info(f'Initializing model: {model_name} ')
-            # Use ISNet General Use model for better precision (more accurate than u2net)
-            # Alternative models: 'u2net', 'u2net_human_seg', 'u2netp', 'silueta', 'isnet-general-use', 'sam'
-            _sessions[model_name] = new_session(model_name)
-            logger.info(f'Model {model_name} initialized successfully')
-        return _sessions[model_name]
+# Model sessions are pooled in model_registry (FP32 and quantized INT8 variants)
 
 def initialize_models():
     """Pre-initialize all models at startup to download them once."""
@@ -106,84 +206,608 @@ def initialize_models():
     
     logger.info('Model initialization complete')
 
+# Working long-side limit per pipeline, used to cost requests at decode size
+PIPELINE_MAX_SIDE = {
+    'remove-bg': REMOVE_BG_MAX_SIDE,
+    'remove-bg-video': VIDEO_MAX_SIDE,
+}
+
+def _working_size(width, height, max_side):
+    if not max_side or max(width, height) <= max_side:
+        return width, height
+    ratio = max_side / max(width, height)
+    return int(width * ratio), int(height * ratio)
+
+def _error_response(message, status, retry_after=None):
+    response = jsonify({'error': message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return _error_response(f'Upload exceeds the {MAX_UPLOAD_BYTES} byte limit', 413)
+
+def admission_controlled(pipeline, image_field='image', default_size=None, header_reader=read_image_header, units=1):
+    """Admit the request only if its estimated cost fits the global budget.
+
+    The cost is estimated from the first file in image_field, or from
+    default_size when the request carries no upload (e.g. a server-side video),
+    times `units` (e.g. pages processed at once). default_size may also be a
+    callable returning the size for the current request, or None when unknown.
+    Requests that cannot be admitted get a 503 with a Retry-After header.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            image_file = request.files.get(image_field)
+            if image_file is not None:
+                try:
+                    header = header_reader(image_file.stream, MAX_IMAGE_PIXELS)
+                except ImageTooLarge as e:
+                    return _error_response(str(e), 413)
+                except InvalidImage as e:
+                    return _error_response(str(e), 400)
+                width, height = header.width, header.height
+            else:
+                size = default_size() if callable(default_size) else default_size
+                if size is None:
+                    return view(*args, **kwargs)
+                width, height = size
+            original_size = (width, height)
+            width, height = _working_size(width, height, PIPELINE_MAX_SIDE.get(pipeline))
+            cost_key = pipeline
+            restore_pixels = 0
+            if pipeline == 'remove-bg':
+                matting = _form_flag('alpha_matting')
+                if matting:
+                    cost_key = 'remove-bg-matting'
+                if _form_flag('full_size', 'true'):
+                    # Decoded at full size; only alpha matting runs at the working size,
+                    # with the full-size RGBA and its upscaled alpha alive for the restore
+                    if not matting:
+                        width, height = original_size
+                    elif (width, height) != original_size:
+                        restore_pixels = original_size[0] * original_size[1]
+            cost_mb = estimate_cost_mb(width, height, cost_key) * units
+            cost_mb += restore_pixels * RESTORE_BYTES_PER_PIXEL / (1024 * 1024)
+            try:
+                admission_controller.acquire(cost_mb, pipeline)
+            except AdmissionRejected as e:
+                logger.warning(f'Rejected {pipeline} request ({width}x{height}): {e.reason}')
+                return _error_response(e.reason, 503, e.retry_after)
+            streamed = False
+            try:
+                with metrics.timed(f'request.{pipeline}'):
+                    response = view(*args, **kwargs)
+                # Streamed responses keep working after the view returns, so
+                # keep the slot until the server closes the response
+                if isinstance(response, Response) and response.is_streamed:
+                    # Werkzeug hands direct_passthrough bodies (send_file) to the server
+                    # without close callbacks; iterate them so close() always runs
+                    response.direct_passthrough = False
+                    response.call_on_close(lambda: admission_controller.release(cost_mb))
+                    streamed = True
+                return response
+            finally:
+                if not streamed:
+                    admission_controller.release(cost_mb)
+        return wrapper
+    return decorator
+
+def _is_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def profiled(pipeline):
+    """Run a sampling profiler around the request when asked to.
+
+    Profiling is requested per call with `X-Profile: 1` plus a valid
+    X-Admin-Token, or armed for the next N requests via POST /admin/profiling.
+    The response carries X-Profile-Id; streamed responses are profiled until
+    they close. Apply below admission_controlled so queueing is not sampled.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ADMIN_TOKEN:
+                return view(*args, **kwargs)
+            wanted = request.headers.get('X-Profile') == '1' and _is_admin()
+            if not wanted and not profile_store.take_armed():
+                return view(*args, **kwargs)
+            profile = Profile(pipeline, PROFILE_INTERVAL_MS / 1000.0, PROFILE_MAX_SECONDS).start()
+
+            def finish():
+                profile.stop()
+                try:
+                    profile_store.save(profile)
+                    logger.info(f'Saved profile {profile.id} ({profile.samples} samples)')
+                except OSError as e:
+                    logger.error(f'Failed to save profile {profile.id}: {e}')
+
+            streamed = False
+            try:
+                response = app.make_response(view(*args, **kwargs))
+                response.headers['X-Profile-Id'] = profile.id
+                if response.is_streamed:
+                    response.call_on_close(finish)
+                    streamed = True
+                return response
+            finally:
+                if not streamed:
+                    finish()
+        return wrapper
+    return decorator
+
+def captured(header_reader=read_image_header):
+    """Record the request to the traffic capture (TRAFFIC_CAPTURE_PATH).
+
+    Apply outermost so the recorded latency is what the client saw,
+    including queueing and coalescing; streamed responses are timed until
+    they close.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if traffic_recorder is None or not traffic_recorder.sampled():
+                return view(*args, **kwargs)
+            try:
+                entry = traffic_recorder.describe(request.path, request.files, request.form,
+                                                  header_reader, MAX_IMAGE_PIXELS)
+            except Exception as e:
+                logger.error(f'Traffic capture failed for {request.path}: {e}')
+                return view(*args, **kwargs)
+            # Measured from here so describing the upload is not counted
+            start = time.perf_counter()
+
+            def finish(status, size=None, streamed=False):
+                entry.update(status=status, durationMs=round(1000 * (time.perf_counter() - start), 1))
+                if size is not None:
+                    entry['responseBytes'] = size
+                if streamed:
+                    entry['streamed'] = True
+                traffic_recorder.record(entry)
+
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except Exception:
+                finish(500)
+                raise
+            if response.is_streamed:
+                response.call_on_close(lambda: finish(response.status_code, streamed=True))
+            else:
+                finish(response.status_code, response.calculate_content_length())
+            return response
+        return wrapper
+    return decorator
+
+_flight_groups = {}
+
+def _form_flag(name, default='false'):
+    return request.form.get(name, default).lower() == 'true'
+
+def coalesced(name):
+    """Share one computation between identical concurrent requests.
+
+    The key is the endpoint, the uploaded image bytes and all form fields.
+    Apply above admission_controlled so only the leader takes a slot; the
+    leader's response is materialised and replayed to every waiter, so
+    progressive (streamed) requests are not coalesced.
+    """
+    group = Group(name)
+    _flight_groups[name] = group
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            image_file = request.files.get('image')
+            # Profiled requests must run their own computation to be sampled
+            if (image_file is None or not SINGLEFLIGHT_ENABLED or _form_flag('progressive')
+                    or (request.headers.get('X-Profile') == '1' and _is_admin())):
+                return view(*args, **kwargs)
+            key = request_key(request.path, image_file.stream, request.form.items(multi=True))
+
+            def run():
+                response = app.make_response(view(*args, **kwargs))
+                response.direct_passthrough = False
+                try:
+                    return response.get_data(), response.status_code, list(response.headers.items())
+                finally:
+                    # Runs call_on_close callbacks (e.g. releasing the admission slot)
+                    response.close()
+
+            (body, status, headers), shared = group.do(key, run)
+            response = app.response_class(body, status=status, headers=headers)
+            if shared:
+                response.headers['X-Coalesced'] = 'true'
+            return response
+        return wrapper
+    return decorator
+
 @app.route('/')
 def home():
     return jsonify({"message": "Rembg API is running"})
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Report admission state (queue depth, rejections) and request timings."""
+    data = metrics.snapshot()
+    data['admission'] = admission_controller.stats()
+    data['singleflight'] = {name: {'inFlight': group.in_flight()} for name, group in _flight_groups.items()}
+    data['serverMode'] = SERVER_MODE
+    data['models'] = loaded_models()
+    return jsonify(data)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """Arm the profiler for the next `count` requests (POST) or show its state."""
+    if not ADMIN_TOKEN:
+        return _error_response('Not found', 404)
+    if not _is_admin():
+        return _error_response('Forbidden', 403)
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or request.form
+        try:
+            profile_store.arm(int(payload.get('count', 1)))
+        except (TypeError, ValueError):
+            return _error_response('count must be an integer', 400)
+    return jsonify({'armed': profile_store.armed, 'directory': PROFILE_DIR, 'maxCount': PROFILE_MAX_COUNT})
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    """List stored profiles, newest first."""
+    if not ADMIN_TOKEN:
+        return _error_response('Not found', 404)
+    if not _is_admin():
+        return _error_response('Forbidden', 403)
+    return jsonify({'profiles': profile_store.list()})
+
+@app.route('/admin/profiles/<profile_id>')
+def admin_profile(profile_id):
+    """Download a profile in collapsed-stack format (flamegraph.pl, speedscope)."""
+    if not ADMIN_TOKEN:
+        return _error_response('Not found', 404)
+    if not _is_admin():
+        return _error_response('Forbidden', 403)
+    path = profile_store.collapsed_path(profile_id)
+    if path is None:
+        return _error_response('Profile not found', 404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'{profile_id}.collapsed')
+
 @app.route('/remove-bg', methods=['POST'])
+@captured()
+@coalesced('remove-bg')
+@admission_controlled('remove-bg')
+@profiled('remove-bg')
 def remove_bg():
     if 'image' not in request.files:
         return jsonify({'error': 'No image uploaded'}), 400
 
+    request_start = time.perf_counter()
     try:
         image_file = request.files['image']
         
-        # Preserve original image format and quality
-        input_image = Image.open(image_file.stream)
-        # Convert to RGBA if not already (ensures alpha channel support)
-        if input_image.mode != 'RGBA':
-            input_image = input_image.convert('RGBA')
+        # Full-size output decodes the upload once at full size; otherwise decode
+        # at working resolution (JPEG draft mode for large photos). Always RGBA.
+        full_size = _form_flag('full_size', 'true')
+        with stage('decode'):
+            loaded = load_image(image_file.stream, 'RGBA', max_side=None if full_size else REMOVE_BG_MAX_SIDE,
+                                max_pixels=MAX_IMAGE_PIXELS)
+        input_image = loaded.image
         
         # Get model type from request (optional parameter)
         model_type = request.form.get('model', 'isnet-general-use').lower()
-        
-        # this auto detects ki if its image of person or not and selects best model
-        if model_type == 'auto':
-            # Simple heuristic: if width/height ratio suggests portrait and image is medium-large
-            width, height = input_image.size
-            aspect_ratio = width / height if height > 0 else 1
-            is_portrait_oriented = aspect_ratio < 0.75 or aspect_ratio > 1.33
-            is_large = width > 512 or height > 512
-            
-            if is_portrait_oriented and is_large:
-                model_type = 'u2net_human_seg'  # Better for portraits/people
-            else:
-                model_type = 'isnet-general-use'  # Best general-purpose model
+        # 'fp32' or 'int8' (quantized variant); defaults to MODEL_PRECISION
+        precision = resolve_precision(request.form.get('precision'))
+        session_for = functools.partial(get_session, precision=precision)
         
         # Validate model type
         valid_models = ['u2net', 'u2net_human_seg', 'u2netp', 'silueta', 'isnet-general-use', 'sam']
-        if model_type not in valid_models:
+        if model_type != 'auto' and model_type not in valid_models:
             model_type = 'isnet-general-use'  # Default to best general model
         
-        # Get session for the selected model (already cached if initialized at startup)
-        session = get_session(model_type)
-        
         # Get alpha matting parameters for better edge refinement (optional)
-        alpha_matting = request.form.get('alpha_matting', 'false').lower() == 'true'
-        alpha_matting_foreground_threshold = int(request.form.get('alpha_matting_foreground_threshold', '240'))
-        alpha_matting_background_threshold = int(request.form.get('alpha_matting_background_threshold', '10'))
-        alpha_matting_erode_size = int(request.form.get('alpha_matting_erode_size', '10'))
+        matting = {
+            'alpha_matting': _form_flag('alpha_matting'),
+            'foreground_threshold': int(request.form.get('alpha_matting_foreground_threshold', '240')),
+            'background_threshold': int(request.form.get('alpha_matting_background_threshold', '10')),
+            'erode_size': int(request.form.get('alpha_matting_erode_size', '10')),
+        }
+        # Only alpha matting scales badly with resolution: matte at working size
+        # and upscale the alpha onto the full-size pixels afterwards
+        if matting['alpha_matting']:
+            input_image, _ = downscale_for_analysis(input_image, REMOVE_BG_MAX_SIDE)
         
-        # Remove background with optional alpha matting for smoother edges
-        if alpha_matting:
-            output_image = remove(
-                input_image,
-                session=session,
-                alpha_matting=True,
-                alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
-                alpha_matting_background_threshold=alpha_matting_background_threshold,
-                alpha_matting_erode_size=alpha_matting_erode_size
-            )
+        if model_type == 'auto':
+            # Cascade: cheap u2netp first, heavier model only when its mask looks unsure
+            def finalize():
+                mask, info = run_cascade(input_image, session_for, CASCADE_STAGES, CASCADE_CONFIDENCE_THRESHOLD)
+                info['precision'] = available_precision(info['model'], precision)
+                return cutout(input_image, mask, **matting), info
         else:
-            # Standard removal - still high quality
-            output_image = remove(input_image, session=session)
+            # Get session for the selected model (already cached if initialized at startup)
+            session = session_for(model_type)
+            
+            def finalize():
+                info = {'model': model_type, 'precision': available_precision(model_type, precision)}
+                return remove_background(input_image, session, **matting), info
+        
+        if _form_flag('progressive'):
+            # Stream a quick low-resolution preview first, then the final cut-out
+            stream = _progressive_remove_bg(input_image, finalize, session_for, loaded, request_start)
+            return Response(stream, mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+        
+        # Remove background with optional alpha matting for smoother edges
+        with stage('inference'):
+            output_image, model_info = finalize()
+        if output_image.size != loaded.image.size:
+            with stage('restore'):
+                output_image = _restore_original_size(output_image, loaded.image)
+        metrics.observe('remove_bg.time_to_final', time.perf_counter() - request_start)
         
         # Save output image to memory with maximum quality
-        img_bytes = io.BytesIO()
-        # Use PNG for lossless quality (preserves alpha channel perfectly)
-        output_image.save(img_bytes, format='PNG', optimize=False)
-        img_bytes.seek(0)
+        with stage('encode'):
+            img_bytes = io.BytesIO()
+            # Use PNG for lossless quality (preserves alpha channel perfectly)
+            output_image.save(img_bytes, format='PNG', optimize=False)
+            img_bytes.seek(0)
 
         # Return the processed image
-        return send_file(img_bytes, mimetype='image/png')
+        response = send_file(img_bytes, mimetype='image/png')
+        response.headers['X-Model-Used'] = model_info['model']
+        response.headers['X-Model-Precision'] = model_info['precision']
+        if 'escalated' in model_info:
+            response.headers['X-Cascade-Escalated'] = str(model_info['escalated']).lower()
+        if loaded.downscaled:
+            response.headers['X-Original-Width'] = str(loaded.original_size[0])
+            response.headers['X-Original-Height'] = str(loaded.original_size[1])
+        return response
         
+    except ImageTooLarge as e:
+        return _error_response(str(e), 413)
+    except InvalidImage as e:
+        return _error_response(str(e), 400)
     except Exception as e:
         logger.error(f'Error processing image: {e}')
         return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
 
+def _restore_original_size(output_image, original):
+    """Cut-out at the upload's full size: the working-size alpha upscaled onto the original pixels."""
+    alpha = output_image.getchannel('A').resize(original.size, Image.Resampling.LANCZOS)
+    original.putalpha(alpha)
+    return original
+
+def _progressive_remove_bg(input_image, finalize, session_for, loaded, request_start):
+    """Yield NDJSON events: a fast u2netp preview, then the full-quality result.
+
+    finalize() returns (output_image, model_info) for the final stage, which is
+    restored to the decoded size (loaded.image) like the non-progressive response.
+    """
+    original_size = loaded.original_size
+
+    def event(stage, image, **extra):
+        payload = {
+            'stage': stage,
+            'image': png_data_url(image),
+            'width': image.size[0],
+            'height': image.size[1],
+            'originalSize': {'width': original_size[0], 'height': original_size[1]},
+            'elapsedMs': round(1000 * (time.perf_counter() - request_start), 1),
+        }
+        payload.update(extra)
+        return json.dumps(payload) + '\n'
+
+    try:
+        with stage('preview'):
+            preview_source = downscale(input_image, PREVIEW_MAX_SIDE)
+            preview_mask = predict_mask(preview_source, session_for(PREVIEW_MODEL))
+            preview = cutout(preview_source, preview_mask)
+        metrics.observe('remove_bg.time_to_preview', time.perf_counter() - request_start)
+        yield event('preview', preview, model=PREVIEW_MODEL)
+        del preview_source, preview_mask, preview
+    except Exception as e:
+        # A failed preview should not cost the user the final result
+        logger.warning(f'Preview generation failed: {e}')
+
+    try:
+        with stage('inference'):
+            output_image, model_info = finalize()
+        if output_image.size != loaded.image.size:
+            with stage('restore'):
+                output_image = _restore_original_size(output_image, loaded.image)
+        metrics.observe('remove_bg.time_to_final', time.perf_counter() - request_start)
+        yield event('final', output_image, **model_info)
+    except Exception as e:
+        logger.error(f'Error processing image: {e}')
+        yield json.dumps({'stage': 'error', 'error': f'Failed to process image: {str(e)}'}) + '\n'
+
+def _resolve_video_path(video_path):
+    """Real path of a server-side video inside VIDEO_INPUT_DIR, or None."""
+    if not VIDEO_INPUT_DIR:
+        return None
+    root = os.path.realpath(VIDEO_INPUT_DIR)
+    path = os.path.realpath(os.path.join(root, video_path))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        return None
+    return path
+
+@app.route('/remove-bg/video', methods=['POST'])
+@captured()
+@admission_controlled('remove-bg-video', image_field='frames', default_size=(VIDEO_MAX_SIDE, VIDEO_MAX_SIDE * 9 // 16))
+@profiled('remove-bg-video')
+def remove_bg_video():
+    """Stream per-frame foreground masks for an image sequence or a video file.
+
+    Input is either repeated `frames` uploads (in order) or a `video_path`
+    relative to VIDEO_INPUT_DIR. Full inference only runs on keyframes; masks
+    in between are propagated with optical flow (see video_matting.py).
+    Frames are decoded one at a time, so memory does not grow with clip length.
+    """
+    # Validate the form before taking over any upload stream
+    try:
+        keyframe_interval = int(request.form.get('keyframe_interval', VIDEO_KEYFRAME_INTERVAL))
+        scene_threshold = float(request.form.get('scene_threshold', '0.4'))
+    except ValueError:
+        return jsonify({'error': 'keyframe_interval must be an integer and scene_threshold a number'}), 400
+    if not np.isfinite(scene_threshold):
+        return jsonify({'error': 'scene_threshold must be a finite number'}), 400
+    model_type = request.form.get('model', 'isnet-general-use').lower()
+    valid_models = ['u2net', 'u2net_human_seg', 'u2netp', 'silueta', 'isnet-general-use']
+    if model_type not in valid_models:
+        model_type = 'isnet-general-use'
+    precision = resolve_precision(request.form.get('precision'))
+
+    frame_files = request.files.getlist('frames')
+    video_path = request.form.get('video_path')
+    frame_streams = []
+
+    def close_streams():
+        for stream in frame_streams:
+            stream.close()
+
+    if frame_files:
+        # Take over the spooled uploads: the request closes its files when the
+        # view returns, but frames are decoded lazily while the response streams
+        for f in frame_files:
+            frame_streams.append(f.stream)
+            f.stream = io.BytesIO()
+        frames = (np.asarray(load_image(stream, 'RGB', max_side=VIDEO_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS).image)
+                  for stream in frame_streams)
+    elif video_path:
+        resolved = _resolve_video_path(video_path)
+        if resolved is None:
+            return jsonify({'error': 'video_path is not available on this server'}), 400
+        frames = iter_video_frames(resolved, VIDEO_MAX_SIDE)
+    else:
+        return jsonify({'error': 'No frames or video_path provided'}), 400
+
+    try:
+        session = get_session(model_type, precision)
+        # Report what was loaded: INT8 falls back to FP32 without a quantized file
+        precision = available_precision(model_type, precision)
+        propagator = MaskPropagator(
+            lambda img: predict_mask(img, session),
+            keyframe_interval=keyframe_interval,
+            scene_threshold=scene_threshold,
+        )
+    except Exception as e:
+        close_streams()
+        logger.error(f'Error preparing video matting: {e}')
+        return jsonify({'error': f'Failed to process video: {str(e)}'}), 500
+
+    def generate():
+        start = time.perf_counter()
+        count = keyframes = 0
+        try:
+            for index, frame in enumerate(frames):
+                with metrics.timed('video.frame'):
+                    mask, info = propagator.process(frame)
+                count += 1
+                keyframes += info['keyframe']
+                payload = {
+                    'frame': index,
+                    'mask': png_data_url(Image.fromarray(mask, 'L')),
+                    'width': int(mask.shape[1]),
+                    'height': int(mask.shape[0]),
+                    'elapsedMs': round(1000 * (time.perf_counter() - start), 1),
+                }
+                payload.update(info)
+                yield json.dumps(payload) + '\n'
+        except Exception as e:
+            logger.error(f'Error processing video frame {count}: {e}')
+            yield json.dumps({'error': f'Failed to process frame {count}: {str(e)}'}) + '\n'
+        finally:
+            close_streams()
+            metrics.incr('video.frames', count)
+            metrics.incr('video.keyframes', keyframes)
+        elapsed = time.perf_counter() - start
+        yield json.dumps({
+            'done': True,
+            'frames': count,
+            'keyframes': keyframes,
+            'model': model_type,
+            'precision': precision,
+            'fps': round(count / elapsed, 2) if elapsed else None,
+        }) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+    # Also covers a response that is closed before the generator ever starts
+    response.call_on_close(close_streams)
+    return response
+
 # (moved OCR and segmentation helpers to image_processing.py and sam_segmentation.py)
 
+def _make_editable_page(input_image, method='fill'):
+    """OCR one page, erase its text and build the Fabric text objects.
+
+    The stages run as a dependency graph (stage_graph.py): quad detection
+    overlaps with speculative OCR preprocessing of the unrectified page, and
+    after OCR, erase -> encode runs alongside grouping -> color estimation.
+    """
+    # Analysis runs on a reduced copy; word boxes are scaled back afterwards.
+    analysis_image, analysis_scale = downscale_for_analysis(input_image, MAKE_EDITABLE_OCR_MAX_SIDE)
+
+    def ocr_input():
+        # Speculative: used as-is when no document quad is found (the common case)
+        return preprocess_image_for_ocr(analysis_image) if TESSERACT_AVAILABLE else None
+
+    def ocr(quad, ocr_input=None):
+        # OCR with perspective rectification (maps bboxes back to original space)
+        rectified, H, H_inv = warp_to_quad(analysis_image, quad)
+        if H_inv is None:
+            prepared = ocr_input.result() if ocr_input else (
+                preprocess_image_for_ocr(rectified) if TESSERACT_AVAILABLE else None)
+        else:
+            if ocr_input:
+                ocr_input.cancel()
+            prepared = preprocess_image_for_ocr(rectified) if TESSERACT_AVAILABLE else None
+        text_data = extract_text_from_preprocessed(*prepared, TESSERACT_AVAILABLE) if prepared else {'words': [], 'full_text': ''}
+        if H_inv is not None:
+            text_data = map_words_to_original(text_data, H_inv)
+        if analysis_scale != 1.0:
+            text_data['words'] = [dict(w, bbox=scale_bbox(w.get('bbox', {}), analysis_scale))
+                                  for w in text_data.get('words', [])]
+        logger.info(f'Found {len(text_data.get("words", []))} text elements')
+        return text_data, H_inv is not None
+
+    def encode(erase):
+        img_bytes = io.BytesIO()
+        erase.save(img_bytes, format='PNG')
+        return 'data:image/png;base64,' + base64.b64encode(img_bytes.getvalue()).decode('utf-8')
+
+    graph = StageGraph('make_editable').add('quad', lambda: detect_document_quad(analysis_image))
+    if SPECULATIVE_OCR:
+        graph.add('ocr_input', ocr_input)
+    graph = (graph
+             .add('ocr', ocr, deps=('quad',), speculative=('ocr_input',) if SPECULATIVE_OCR else ())
+             # Clean only the text regions (no background removal)
+             .add('erase', lambda ocr: erase_text_regions(input_image, ocr[0].get('words', []), method=method,
+                                                          executor=inpaint_executor), deps=('ocr',))
+             .add('encode', encode, deps=('erase',))
+             # Group words into lines and build Fabric-compatible text objects
+             .add('group', lambda ocr: group_words_into_lines(ocr[0].get('words', [])), deps=('ocr',))
+             .add('objects', lambda group: build_fabric_text_objects_from_lines(input_image, group), deps=('group',)))
+    results, timings = graph.run(stage_executor)
+    text_data, homography_applied = results['ocr']
+
+    return {
+        'baseImage': results['encode'],
+        'objects': results['objects'],
+        'imageSize': {
+            'width': int(input_image.size[0]),
+            'height': int(input_image.size[1])
+        },
+        'text': text_data,
+        'homographyApplied': homography_applied,
+        'timings': timings.as_dict()
+    }
+
 @app.route('/make-editable', methods=['POST'])
+@captured()
+@coalesced('make-editable')
+@admission_controlled('make-editable')
+@profiled('make-editable')
 def make_editable():
     """Smart Text Replacement Mask
 
@@ -196,79 +820,128 @@ def make_editable():
     
     try:
         image_file = request.files['image']
-        input_image = Image.open(image_file.stream)
-        
-        # Convert to RGB if needed
-        if input_image.mode != 'RGB':
-            input_image = input_image.convert('RGB')
+        # The cleaned base image is returned at full resolution, so decode fully
+        with stage('decode'):
+            input_image = load_image(image_file.stream, 'RGB', max_pixels=MAX_IMAGE_PIXELS).image
         
         logger.info(f'Processing image for editing: {input_image.size}')
-
-        # 1) OCR with perspective rectification (maps bboxes back to original space)
-        text_data, H, H_inv = ocr_with_rectification(input_image, TESSERACT_AVAILABLE)
-        words = text_data.get('words', [])
-        logger.info(f'Found {len(words)} text elements')
-
-        # 2) Clean only the text regions (no background removal)
         method = request.form.get('text_clean_method', 'fill')  # 'fill' or 'blur'
-        cleaned_image = erase_text_regions(input_image, words, method=method)
-
-        # 3) Convert cleaned image to base64 data URL
-        img_bytes = io.BytesIO()
-        cleaned_image.save(img_bytes, format='PNG')
-        img_bytes.seek(0)
-        base64_data = base64.b64encode(img_bytes.read()).decode('utf-8')
-        base_image_data_url = f'data:image/png;base64,{base64_data}'
-
-        # 4) Group words into lines and build Fabric-compatible text objects
-        lines = group_words_into_lines(words)
-        fabric_objects = build_fabric_text_objects_from_lines(input_image, lines)
-
-        response = {
-            'baseImage': base_image_data_url,
-            'objects': fabric_objects,
-            'imageSize': {
-                'width': int(input_image.size[0]),
-                'height': int(input_image.size[1])
-            },
-            'text': text_data,
-            'homographyApplied': H_inv is not None
-        }
-
-        return jsonify(response)
+        return jsonify(_make_editable_page(input_image, method))
         
+    except ImageTooLarge as e:
+        return _error_response(str(e), 413)
+    except InvalidImage as e:
+        return _error_response(str(e), 400)
     except Exception as e:
         logger.error(f'Error making image editable: {e}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Failed to process image: {str(e)}'}), 500
 
+def _read_document_header(stream, max_pixels):
+    return read_document_header(stream, max_pixels, DOCUMENT_PDF_DPI)
+
+@app.route('/make-editable/document', methods=['POST'])
+@captured(header_reader=_read_document_header)
+@admission_controlled('make-editable', header_reader=_read_document_header, units=DOCUMENT_PAGES_IN_FLIGHT)
+@profiled('make-editable-document')
+def make_editable_document():
+    """Multi-page /make-editable for TIFF and PDF documents.
+
+    Pages are decoded lazily, one at a time, and processed on the shared page
+    pool with at most DOCUMENT_PAGES_IN_FLIGHT pages per request in flight.
+    Results stream back as NDJSON in page order (same fields as /make-editable
+    plus `page`), followed by a summary line.
+    """
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image uploaded'}), 400
+
+    image_file = request.files['image']
+    # Take over the spooled upload: the request closes its files when the view
+    # returns, but pages are decoded while the response streams
+    stream = image_file.stream
+    image_file.stream = io.BytesIO()
+    method = request.form.get('text_clean_method', 'fill')
+    pages = iter_document_pages(stream, 'RGB', max_pixels=MAX_IMAGE_PIXELS,
+                                max_pages=DOCUMENT_MAX_PAGES, pdf_dpi=DOCUMENT_PDF_DPI)
+
+    def process(page_image):
+        with metrics.timed('make_editable.page'):
+            return _make_editable_page(page_image, method)
+
+    def generate():
+        start = time.perf_counter()
+        pending = deque()
+        done = failed = 0
+        try:
+            while True:
+                # Keep the window full; the next page is only decoded once a slot frees up
+                while len(pending) < DOCUMENT_PAGES_IN_FLIGHT:
+                    page = next(pages, None)
+                    if page is None:
+                        break
+                    index, page_image = page
+                    pending.append((index, page_executor.submit(bind(process), page_image)))
+                    del page, page_image
+                if not pending:
+                    break
+                index, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f'Error making page {index + 1} editable: {e}')
+                    result = {'error': f'Failed to process page: {str(e)}'}
+                    failed += 1
+                done += 1
+                result['page'] = index
+                result['elapsedMs'] = round(1000 * (time.perf_counter() - start), 1)
+                yield json.dumps(result) + '\n'
+                del result
+        except (ImageTooLarge, InvalidImage) as e:
+            yield json.dumps({'error': str(e), 'page': done}) + '\n'
+        except Exception as e:
+            logger.error(f'Error reading document page {done + 1}: {e}')
+            yield json.dumps({'error': f'Failed to read page: {str(e)}', 'page': done}) + '\n'
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pages.close()
+            stream.close()
+            metrics.incr('make_editable.pages', done)
+        yield json.dumps({'done': True, 'pages': done, 'failed': failed}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+
+def _decode_text_base(data):
+    # Edits are positioned in original pixels, so decode at full size;
+    # RGBA input is composited onto a white background
+    with stage('decode'):
+        return load_image(io.BytesIO(data), 'RGB', max_pixels=MAX_IMAGE_PIXELS, flatten_alpha=True).image
+
+def _cached_text_base_size():
+    # baseId-only requests are costed from the cached base (None: unknown, answered with 409)
+    return text_compositor.base_size(request.form.get('baseId'))
+
 @app.route('/integrate-text', methods=['POST'])
+@captured()
+@admission_controlled('integrate-text', default_size=_cached_text_base_size)
+@profiled('integrate-text')
 def integrate_text():
     """Integrate edited text onto the image with proper rendering.
     
-    - Takes original image and array of edited text objects
-    - Renders text onto the image using PIL with proper fonts and positioning
-    - Returns the integrated image as base64 data URL
+    - Takes the original image (or the baseId of one sent earlier) and an array of edited text objects
+    - Renders each edit into its own RGBA layer and composites only the tiles that changed
+    - Returns the integrated image as base64 data URL, or just the changed tiles (output=tiles)
     """
-    if 'image' not in request.files:
+    image_file = request.files.get('image')
+    base_id = request.form.get('baseId')
+    if image_file is None and not base_id:
         return jsonify({'error': 'No image uploaded'}), 400
+    output = request.form.get('output', 'full').lower()
+    if output not in ('full', 'tiles'):
+        return jsonify({'error': 'output must be "full" or "tiles"'}), 400
     
     try:
-        image_file = request.files['image']
-        input_image = Image.open(image_file.stream)
-        
-        # Convert to RGB if needed (supports transparency)
-        if input_image.mode == 'RGBA':
-            # Create white background for RGBA images
-            background = Image.new('RGB', input_image.size, (255, 255, 255))
-            background.paste(input_image, mask=input_image.split()[3])  # Use alpha channel as mask
-            input_image = background
-        elif input_image.mode != 'RGB':
-            input_image = input_image.convert('RGB')
-        
-        logger.info(f'Integrating text into image: {input_image.size}')
-        
         # Get edited text data from JSON
         text_edits_json = request.form.get('textEdits', '[]')
         try:
@@ -279,165 +952,86 @@ def integrate_text():
         if not isinstance(text_edits, list):
             return jsonify({'error': 'textEdits must be an array'}), 400
         
+        placements = [p for p in (parse_text_edit(edit) for edit in text_edits) if p is not None]
         logger.info(f'Processing {len(text_edits)} text edits')
         
-        # Create a copy of the image for drawing
-        output_image = input_image.copy()
-        draw = ImageDraw.Draw(output_image)
+        load_base = None
+        if image_file is not None:
+            data = image_file.stream.read()
+            base_id = text_compositor.base_id(data)
+            load_base = functools.partial(_decode_text_base, data)
         
-        # Try to find system fonts
-        default_font_paths = []
-        if os.name == 'nt':  # Windows
-            font_dirs = [
-                r'C:\Windows\Fonts',
-                r'C:\Windows\Fonts\arial.ttf',
-                r'C:\Windows\Fonts\arialbd.ttf',
-            ]
-        elif os.name == 'posix':  # Linux/Mac
-            font_dirs = [
-                '/usr/share/fonts',
-                '/System/Library/Fonts',
-                '/Library/Fonts',
-            ]
+        with stage('render'):
+            result = text_compositor.compose(base_id, placements, load_base)
+        if result is None:
+            return jsonify({'error': 'Unknown baseId, upload the image again', 'baseId': base_id}), 409
         
-        # Function to get font
-        def get_font(font_family='Arial', font_size=32, font_weight='normal'):
-            font_path = None
-            font_name_lower = font_family.lower()
-            
-            # Try to find the font file
-            if os.name == 'nt':  # Windows
-                font_mapping = {
-                    'arial': 'arial.ttf',
-                    'times new roman': 'times.ttf',
-                    'courier': 'cour.ttf',
-                    'helvetica': 'arial.ttf',
-                }
-                font_file = font_mapping.get(font_name_lower, 'arial.ttf')
-                font_paths_to_try = [
-                    f'C:\\Windows\\Fonts\\{font_file}',
-                    'C:\\Windows\\Fonts\\arial.ttf',
-                ]
-            else:  # Linux/Mac
-                font_paths_to_try = [
-                    f'/System/Library/Fonts/{font_family}.ttf',
-                    f'/Library/Fonts/{font_family}.ttf',
-                    '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
-                ]
-            
-            # Find first available font
-            for path in font_paths_to_try:
-                if os.path.exists(path):
-                    font_path = path
-                    break
-            
-            # Load font if found, otherwise use default
-            try:
-                if font_path:
-                    # Adjust size for font weight
-                    size = int(font_size)
-                    if font_weight in ['bold', '600', '700']:
-                        try:
-                            # Try bold variant
-                            if os.name == 'nt':
-                                bold_path = font_path.replace('.ttf', 'bd.ttf').replace('.TTF', 'bd.ttf')
-                            else:
-                                bold_path = font_path.replace('Regular', 'Bold')
-                            if os.path.exists(bold_path):
-                                return ImageFont.truetype(bold_path, size)
-                        except:
-                            pass
-                    return ImageFont.truetype(font_path, size)
-                else:
-                    # Fallback to default font
-                    return ImageFont.load_default()
-            except Exception as e:
-                logger.warning(f'Font loading error: {e}, using default')
-                return ImageFont.load_default()
-        
-        # Render each text edit
-        for edit in text_edits:
-            if not isinstance(edit, dict):
-                continue
-            
-            text = edit.get('text', '').strip()
-            if not text:
-                continue
-            
-            # Get position and size
-            bbox = edit.get('bbox', {})
-            x = int(bbox.get('x', 0))
-            y = int(bbox.get('y', 0))
-            width = int(bbox.get('width', 100))
-            height = int(bbox.get('height', 32))
-            
-            # Get styling
-            fill_color = edit.get('fill', edit.get('color', '#000000'))
-            font_family = edit.get('fontFamily', edit.get('font', 'Arial'))
-            font_size = int(edit.get('fontSize', edit.get('size', height * 0.7)))
-            font_weight = edit.get('fontWeight', edit.get('weight', 'normal'))
-            opacity = float(edit.get('opacity', edit.get('alpha', 1.0)))
-            
-            # Convert hex color to RGB
-            if isinstance(fill_color, str) and fill_color.startswith('#'):
-                try:
-                    hex_color = fill_color.lstrip('#')
-                    r = int(hex_color[0:2], 16)
-                    g = int(hex_color[2:4], 16)
-                    b = int(hex_color[4:6], 16)
-                    # Apply opacity
-                    if opacity < 1.0:
-                        # Blend with white background (for simplicity)
-                        r = int(r * opacity + 255 * (1 - opacity))
-                        g = int(g * opacity + 255 * (1 - opacity))
-                        b = int(b * opacity + 255 * (1 - opacity))
-                    fill_rgb = (r, g, b)
-                except:
-                    fill_rgb = (0, 0, 0)
-            elif isinstance(fill_color, (list, tuple)) and len(fill_color) >= 3:
-                fill_rgb = tuple(int(c) for c in fill_color[:3])
-            else:
-                fill_rgb = (0, 0, 0)
-            
-            # Get font
-            font = get_font(font_family, font_size, font_weight)
-            
-            # Draw text
-            try:
-                # Use bbox for positioning
-                draw.text((x, y), text, fill=fill_rgb, font=font)
-                logger.debug(f'Rendered text: "{text}" at ({x}, {y})')
-            except Exception as e:
-                logger.error(f'Error drawing text "{text}": {e}')
-                continue
-        
-        # Convert integrated image to base64 data URL
-        img_bytes = io.BytesIO()
-        output_image.save(img_bytes, format='PNG', quality=95)
-        img_bytes.seek(0)
-        base64_data = base64.b64encode(img_bytes.read()).decode('utf-8')
-        integrated_image_data_url = f'data:image/png;base64,{base64_data}'
+        logger.info(f'Integrating text into image: {result.image.size}, {len(result.tiles)} dirty tiles')
         
         response = {
-            'integratedImage': integrated_image_data_url,
+            'baseId': base_id,
+            'revision': result.revision,
             'imageSize': {
-                'width': int(output_image.size[0]),
-                'height': int(output_image.size[1])
+                'width': int(result.image.size[0]),
+                'height': int(result.image.size[1])
             },
-            'textCount': len(text_edits)
+            'textCount': len(text_edits),
+            'dirtyTiles': len(result.tiles),
         }
         
-        logger.info(f'Text integration complete: {len(text_edits)} text elements rendered')
+        # Tiles only apply on top of the composite the client already has;
+        # anyone else (first call, another client, stale revision) gets it all
+        send_tiles = output == 'tiles' and request.form.get('baseRevision') == result.previous_revision
+        with stage('encode'):
+            if send_tiles:
+                response['tiles'] = [{
+                    'x': box[0],
+                    'y': box[1],
+                    'width': box[2] - box[0],
+                    'height': box[3] - box[1],
+                    'image': png_data_url(tile),
+                } for box, tile in result.tiles]
+            else:
+                # Convert integrated image to base64 data URL
+                response['integratedImage'] = png_data_url(result.image)
+        response['fullImage'] = not send_tiles
+        
+        logger.info(f'Text integration complete: {len(placements)} text elements rendered')
         return jsonify(response)
         
+    except ImageTooLarge as e:
+        return _error_response(str(e), 413)
+    except InvalidImage as e:
+        return _error_response(str(e), 400)
     except Exception as e:
         logger.error(f'Error integrating text: {e}')
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Failed to integrate text: {str(e)}'}), 500
 
+def run_production_server(host, port):
+    """Serve with waitress using a bounded thread pool.
+
+    Worker threads = admitted slots + queue slots, so queued requests wait in
+    the admission controller instead of piling up inside the models.
+    """
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.warning('waitress is not installed, falling back to the Flask development server')
+        return False
+    threads = int(os.environ.get('SERVER_THREADS', ADMISSION_MAX_CONCURRENT + ADMISSION_MAX_QUEUE))
+    logger.info(f'Starting production server on {host}:{port} with {threads} threads '
+                f'(max {ADMISSION_MAX_CONCURRENT} concurrent, budget {ADMISSION_MEMORY_BUDGET_MB:.0f} MB)')
+    serve(app, host=host, port=port, threads=threads,
+          connection_limit=int(os.environ.get('SERVER_CONNECTION_LIMIT', threads * 4)))
+    return True
+
 if __name__ == '__main__':
     logger.info('Starting Rembg backend server...')
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = int(os.environ.get('PORT', 5001))
     # Skip model initialization at startup to prevent restart loops
     # Models will be loaded on-demand when first requested
-    app.run(debug=False, host='0.0.0.0', port=5001, threaded=True)
+    if SERVER_MODE != 'production' or not run_production_server(host, port):
+        app.run(debug=False, host=host, port=port, threaded=True)
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    """Coalesce concurrent calls that share a key into one computation.
+
+    The first caller for a key runs fn(); callers arriving while it is in
+    flight block until it finishes and receive the same result (or exception).
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run fn() once per in-flight key. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            metrics.incr(f'singleflight.{self.name}.shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.incr(f'singleflight.{self.name}.computed')
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.info(f'{self.name}: shared one computation with {call.waiters} duplicate request(s)')
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+def request_key(path, stream, form_items, chunk_size=1024 * 1024):
+    """Build a coalescing key from the endpoint, upload content and form fields.
+
+    The stream is hashed in chunks and rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    digest.update(path.encode('utf-8'))
+    for name, value in sorted(form_items):
+        digest.update(b'\0')
+        digest.update(name.encode('utf-8'))
+        digest.update(b'=')
+        digest.update(value.encode('utf-8'))
+    digest.update(b'\0')
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+    finally:
+        stream.seek(0)
+    return digest.hexdigest()
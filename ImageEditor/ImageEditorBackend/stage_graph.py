@@ -0,0 +1,127 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, wait
+
+import metrics
+from profiling import bind, stage
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraph:
+    """A small dependency graph of pipeline stages run on a thread pool.
+
+    Each stage is a function called with the results of its dependencies as
+    keyword arguments (named after the stages). A stage is submitted as soon
+    as all of its dependencies have finished, so independent stages overlap;
+    OpenCV, Pillow and Tesseract release the GIL for most of their work.
+
+    `speculative` dependencies do not hold a stage back: it receives a
+    Speculative handle instead and only waits for the result if it needs it.
+    A cancelled speculative stage is abandoned: the graph no longer waits for
+    it. They must name stages that are already submitted by then.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._stages = {}
+
+    def add(self, name, fn, deps=(), speculative=()):
+        for dep in tuple(deps) + tuple(speculative):
+            if dep not in self._stages:
+                raise ValueError(f'Stage {name!r} depends on unknown stage {dep!r}')
+        self._stages[name] = (fn, tuple(deps), tuple(speculative))
+        return self
+
+    def _timed(self, name, fn):
+        def run(**kwargs):
+            start = time.perf_counter()
+            with stage(name):
+                result = fn(**kwargs)
+            return result, start, time.perf_counter()
+        # bind() here, in the submitting thread, so workers join its profile
+        return bind(run)
+
+    def run(self, executor):
+        """Run every stage; returns (results by stage name, GraphTimings).
+
+        The first stage to raise cancels the stages not yet started and its
+        exception is re-raised.
+        """
+        results = {}
+        spans = {}
+        pending = dict(self._stages)
+        running = {}
+        submitted = {}
+        abandoned = set()
+        graph_start = time.perf_counter()
+
+        def ready(deps, speculative):
+            return all(d in results for d in deps) and all(d in submitted for d in speculative)
+
+        try:
+            while pending or any(f not in abandoned for f in running):
+                for name in [n for n, (_, deps, spec) in pending.items() if ready(deps, spec)]:
+                    fn, deps, speculative = pending.pop(name)
+                    kwargs = {dep: results[dep] for dep in deps}
+                    kwargs.update({dep: Speculative(submitted[dep], abandoned) for dep in speculative})
+                    submitted[name] = executor.submit(self._timed(name, fn), **kwargs)
+                    running[submitted[name]] = name
+                done, _ = wait([f for f in running if f not in abandoned], return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.cancelled():
+                        results[name] = None
+                        continue
+                    results[name], start, end = future.result()
+                    spans[name] = (start - graph_start, end - graph_start)
+        finally:
+            for future in running:
+                future.cancel()
+        timings = GraphTimings(spans, time.perf_counter() - graph_start)
+        timings.record(self.name)
+        return results, timings
+
+
+class Speculative:
+    """Handle on a stage started ahead of knowing whether it is needed."""
+
+    def __init__(self, future, abandoned):
+        self._future = future
+        self._abandoned = abandoned
+
+    def result(self):
+        """Wait for the stage and return its result (None if it was cancelled)."""
+        try:
+            return self._future.result()[0]
+        except CancelledError:
+            return None
+
+    def cancel(self):
+        """Drop the stage: it is cancelled if not started, otherwise left to finish unobserved."""
+        self._future.cancel()
+        self._abandoned.add(self._future)
+
+
+class GraphTimings:
+    """Per-stage durations of one graph run and its wall time.
+
+    With stages overlapping, wall time is below the sum of the stages; the
+    gap is what the graph saves over running them one after another.
+    """
+
+    def __init__(self, spans, wall):
+        self.stages = {name: end - start for name, (start, end) in spans.items()}
+        self.wall = wall
+
+    def record(self, prefix):
+        for name, seconds in self.stages.items():
+            metrics.observe(f'{prefix}.stage.{name}', seconds)
+        metrics.observe(f'{prefix}.wall', self.wall)
+
+    def as_dict(self):
+        return {
+            'stagesMs': {name: round(1000 * s, 1) for name, s in self.stages.items()},
+            'wallMs': round(1000 * self.wall, 1),
+            'sumMs': round(1000 * sum(self.stages.values()), 1),
+        }
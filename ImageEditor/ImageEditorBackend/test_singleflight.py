@@ -0,0 +1,109 @@
+"""Concurrent identical /remove-bg requests through the Flask test client.
+
+Run from this directory: python -m pytest -q test_singleflight.py
+The rembg session is replaced by a stub, so no model is downloaded.
+"""
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import metrics
+import server
+
+N_REQUESTS = 4
+
+
+class StubSession:
+    """Thresholds red pixels; blocks inside predict() until released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def predict(self, img, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        assert self.release.wait(10), 'stub session was never released'
+        rgb = img.convert('RGB')
+        return [rgb.getchannel('R').point(lambda v: 255 if v > 128 else 0)]
+
+
+@pytest.fixture
+def stub_session(monkeypatch):
+    session = StubSession()
+    monkeypatch.setattr(server, 'get_session', lambda *args, **kwargs: session)
+    metrics.reset()
+    yield session
+    session.release.set()
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _post_concurrently(uploads):
+    responses = [None] * len(uploads)
+
+    def post(i):
+        client = server.app.test_client()
+        response = client.post('/remove-bg', data={'image': (io.BytesIO(uploads[i]), 'a.png')})
+        # Runs call_on_close callbacks, as the WSGI server would
+        response.close()
+        responses[i] = response
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(uploads))]
+    for thread in threads:
+        thread.start()
+    return threads, responses
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, 'timed out waiting for requests'
+        time.sleep(0.01)
+
+
+def test_identical_requests_share_one_computation(stub_session):
+    threads, responses = _post_concurrently([_png((255, 0, 0))] * N_REQUESTS)
+    # Keep the leader inside the model until every follower has joined it
+    _wait_for(lambda: metrics.counter('singleflight.remove-bg.shared') == N_REQUESTS - 1)
+    stub_session.release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert [r.status_code for r in responses] == [200] * N_REQUESTS
+    assert stub_session.calls == 1
+    assert metrics.counter('singleflight.remove-bg.computed') == 1
+    assert sum(r.headers.get('X-Coalesced') == 'true' for r in responses) == N_REQUESTS - 1
+    assert len({r.data for r in responses}) == 1
+    assert server.admission_controller.stats()['inFlight'] == 0
+
+
+def test_different_uploads_are_not_coalesced(stub_session):
+    stub_session.release.set()
+    threads, responses = _post_concurrently([_png((255, 0, 0)), _png((0, 0, 255))])
+    for thread in threads:
+        thread.join(10)
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert stub_session.calls == 2
+    assert metrics.counter('singleflight.remove-bg.shared') == 0
+    assert not any(r.headers.get('X-Coalesced') for r in responses)
+    assert server.admission_controller.stats()['inFlight'] == 0
+
+
+def test_uncoalesced_response_releases_admission_slot(stub_session, monkeypatch):
+    monkeypatch.setattr(server, 'SINGLEFLIGHT_ENABLED', False)
+    stub_session.release.set()
+    for color in [(255, 0, 0), (255, 0, 0)]:
+        response = server.app.test_client().post('/remove-bg', data={'image': (io.BytesIO(_png(color)), 'a.png')})
+        assert response.status_code == 200
+        response.close()
+        assert server.admission_controller.stats()['inFlight'] == 0
@@ -0,0 +1,104 @@
+"""Incremental compositing must match a from-scratch composite of the same edits,
+and layers and caches must stay within the image size and the byte budgets.
+
+Run from this directory: python -m pytest -q test_text_compositor.py
+"""
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from text_compositor import TextCompositor, parse_text_edit
+
+SIZE = (700, 500)
+
+
+def _base():
+    gradient = np.linspace(0, 255, SIZE[0], dtype=np.uint8)
+    pixels = np.stack([np.tile(gradient, (SIZE[1], 1))] * 3, axis=-1)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def _edit(text, x, y, color='#cc2200', opacity=0.6, width=220, height=60):
+    return parse_text_edit({
+        'text': text,
+        'bbox': {'x': x, 'y': y, 'width': width, 'height': height},
+        'fill': color,
+        'fontSize': 40,
+        'opacity': opacity,
+    })
+
+
+A = _edit('Alpha', 100, 100, '#cc2200')
+B = _edit('Bravo', 130, 110, '#0033cc')
+C = _edit('Charlie', 400, 300, '#118811')
+
+
+def _fresh(placements):
+    return np.asarray(TextCompositor().compose('fresh', placements, _base).image)
+
+
+def _incremental(*steps):
+    compositor = TextCompositor()
+    result = None
+    for placements in steps:
+        result = compositor.compose('base', placements, _base)
+    return np.asarray(result.image), result
+
+
+@pytest.mark.parametrize('before, after', [
+    ([A, B], [B, A, C]),
+    ([A], [A, A]),
+    ([A, A], [A]),
+    ([A, B], [B, A]),
+    ([A, B, A], [A, A, B]),
+    ([A, B, C], [C]),
+    ([A], [_edit('Alpha', 300, 200, '#cc2200')]),
+])
+def test_incremental_matches_fresh_render(before, after):
+    image, _ = _incremental(before, after)
+    assert np.array_equal(image, _fresh(after))
+
+
+def test_random_edit_sequences_match_fresh_render():
+    rng = random.Random(7)
+    pool = [_edit(f'Word {i}', rng.randrange(-50, 650), rng.randrange(-20, 470), rng.choice(['#000000', '#ff0000', '#0000ff']),
+                  rng.choice([0.3, 0.7, 1.0])) for i in range(6)]
+    compositor = TextCompositor()
+    for _ in range(30):
+        placements = [rng.choice(pool) for _ in range(rng.randrange(0, 8))]
+        result = compositor.compose('base', placements, _base)
+        assert np.array_equal(np.asarray(result.image), _fresh(placements))
+
+
+def test_unchanged_edits_leave_no_dirty_tiles():
+    _, result = _incremental([A, B, C], [A, B, C])
+    assert result.tiles == []
+    assert result.revision == result.previous_revision
+
+
+def test_bbox_larger_than_image_is_capped():
+    compositor = TextCompositor()
+    huge = _edit('Huge', -100, -100, width=12000, height=12000)
+    result = compositor.compose('base', [huge], _base)
+    assert result.image.size == SIZE
+    assert all(layer.size[0] <= SIZE[0] and layer.size[1] <= SIZE[1] for layer in compositor._layers.values())
+
+
+def test_caches_stay_within_byte_budgets():
+    base_bytes = 2 * SIZE[0] * SIZE[1] * 3
+    layer_bytes = 220 * 60 * 4
+    compositor = TextCompositor(max_base_bytes=2 * base_bytes, max_layer_bytes=3 * layer_bytes)
+    for i in range(5):
+        compositor.compose(f'base-{i}', [_edit(f'Word {i}', 10 * i, 10 * i)], _base)
+    assert [compositor.base_size(f'base-{i}') for i in range(5)] == [None, None, None, SIZE, SIZE]
+    assert compositor._base_bytes == 2 * base_bytes
+    assert len(compositor._layers) == 3 and compositor._layer_bytes == 3 * layer_bytes
+
+
+def test_base_larger_than_its_budget_is_not_cached():
+    compositor = TextCompositor(max_base_bytes=1024)
+    result = compositor.compose('base', [A], _base)
+    assert np.array_equal(np.asarray(result.image), _fresh([A]))
+    assert compositor.base_size('base') is None
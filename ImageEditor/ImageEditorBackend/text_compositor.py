@@ -0,0 +1,364 @@
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MIN_FONT_SIZE = 6
+
+# Everything that affects a layer's pixels; position is not part of it, so a
+# moved edit reuses its cached layer
+TextSpec = namedtuple('TextSpec', 'text font_family font_size font_weight rgba width height')
+Placement = namedtuple('Placement', 'spec x y')
+
+
+def _parse_color(color, opacity):
+    """RGBA tuple from '#rrggbb' or [r, g, b]; opacity becomes real alpha."""
+    alpha = int(round(255 * min(1.0, max(0.0, opacity))))
+    if isinstance(color, str) and color.startswith('#'):
+        try:
+            hex_color = color.lstrip('#')
+            return int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16), alpha
+        except ValueError:
+            return 0, 0, 0, alpha
+    if isinstance(color, (list, tuple)) and len(color) >= 3:
+        return tuple(int(c) for c in color[:3]) + (alpha,)
+    return 0, 0, 0, alpha
+
+
+def parse_text_edit(edit):
+    """Placement for one textEdits entry, or None when there is nothing to draw."""
+    if not isinstance(edit, dict):
+        return None
+    text = edit.get('text', '').strip()
+    if not text:
+        return None
+    bbox = edit.get('bbox', {})
+    width = max(1, int(bbox.get('width', 100)))
+    height = max(1, int(bbox.get('height', 32)))
+    spec = TextSpec(
+        text=text,
+        font_family=edit.get('fontFamily', edit.get('font', 'Arial')),
+        font_size=max(1, int(edit.get('fontSize', edit.get('size', height * 0.7)))),
+        font_weight=str(edit.get('fontWeight', edit.get('weight', 'normal'))),
+        rgba=_parse_color(edit.get('fill', edit.get('color', '#000000')), float(edit.get('opacity', edit.get('alpha', 1.0)))),
+        width=width,
+        height=height,
+    )
+    return Placement(spec, int(bbox.get('x', 0)), int(bbox.get('y', 0)))
+
+
+@functools.lru_cache(maxsize=128)
+def resolve_font(font_family='Arial', font_size=32, font_weight='normal'):
+    """Load a TrueType font by family name, falling back to Pillow's default."""
+    font_path = None
+    font_name_lower = font_family.lower()
+
+    if os.name == 'nt':  # Windows
+        font_mapping = {
+            'arial': 'arial.ttf',
+            'times new roman': 'times.ttf',
+            'courier': 'cour.ttf',
+            'helvetica': 'arial.ttf',
+        }
+        font_file = font_mapping.get(font_name_lower, 'arial.ttf')
+        font_paths_to_try = [
+            f'C:\\Windows\\Fonts\\{font_file}',
+            'C:\\Windows\\Fonts\\arial.ttf',
+        ]
+    else:  # Linux/Mac
+        font_paths_to_try = [
+            f'/System/Library/Fonts/{font_family}.ttf',
+            f'/Library/Fonts/{font_family}.ttf',
+            '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+        ]
+
+    for path in font_paths_to_try:
+        if os.path.exists(path):
+            font_path = path
+            break
+
+    try:
+        if font_path:
+            if font_weight in ['bold', '600', '700']:
+                if os.name == 'nt':
+                    bold_path = font_path.replace('.ttf', 'bd.ttf').replace('.TTF', 'bd.ttf')
+                else:
+                    bold_path = font_path.replace('Regular', 'Bold').replace('DejaVuSans.ttf', 'DejaVuSans-Bold.ttf')
+                if os.path.exists(bold_path):
+                    return ImageFont.truetype(bold_path, font_size)
+            return ImageFont.truetype(font_path, font_size)
+    except Exception as e:
+        logger.warning(f'Font loading error: {e}, using default')
+    try:
+        return ImageFont.load_default(font_size)
+    except TypeError:  # Pillow < 10.1 has a single fixed-size default font
+        return ImageFont.load_default()
+
+
+def _wrap(text, font, width):
+    """Greedy word wrap to `width` pixels (explicit newlines are kept)."""
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f'{line} {word}' if line else word
+            if line and font.getlength(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def render_layer(spec):
+    """Render a text edit into a transparent RGBA layer of its bbox size.
+
+    Text wraps at the bbox width; if it is then taller than the bbox the
+    font shrinks until it fits (down to MIN_FONT_SIZE, then it is clipped).
+    """
+    size = spec.font_size
+    while True:
+        font = resolve_font(spec.font_family, size, spec.font_weight)
+        lines = _wrap(spec.text, font, spec.width)
+        ascent, descent = font.getmetrics() if hasattr(font, 'getmetrics') else (size, 0)
+        line_height = ascent + descent
+        if len(lines) * line_height <= spec.height or size <= MIN_FONT_SIZE:
+            break
+        size = max(MIN_FONT_SIZE, int(size * 0.9))
+
+    layer = Image.new('RGBA', (spec.width, spec.height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    for i, line in enumerate(lines):
+        draw.text((0, i * line_height), line, fill=spec.rgba, font=font)
+    return layer
+
+
+def _tiles_for(box, width, height):
+    """Tile indices (col, row) covering box = (x1, y1, x2, y2), clipped to the image."""
+    x1, y1 = max(0, box[0]), max(0, box[1])
+    x2, y2 = min(width, box[2]), min(height, box[3])
+    if x1 >= x2 or y1 >= y2:
+        return set()
+    return {(col, row)
+            for col in range(x1 // TILE_SIZE, (x2 - 1) // TILE_SIZE + 1)
+            for row in range(y1 // TILE_SIZE, (y2 - 1) // TILE_SIZE + 1)}
+
+
+def _placement_box(placement):
+    return placement.x, placement.y, placement.x + placement.spec.width, placement.y + placement.spec.height
+
+
+def clip_to_image(placement, width, height):
+    """Cap a placement's bbox at the image size so no layer outgrows the image."""
+    spec = placement.spec
+    if spec.width <= width and spec.height <= height:
+        return placement
+    return placement._replace(spec=spec._replace(width=min(spec.width, width), height=min(spec.height, height)))
+
+
+def _image_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def _occurrences(placements):
+    """Key each placement by (placement, n-th occurrence) so duplicates stay distinct."""
+    seen = Counter()
+    keys = []
+    for placement in placements:
+        keys.append((placement, seen[placement]))
+        seen[placement] += 1
+    return keys
+
+
+def _overlap(a, b):
+    box = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def dirty_tiles(old, new, width, height):
+    """Tiles whose pixels differ between compositing `old` and `new` (in stacking order).
+
+    A tile is dirty when an edit covering it was added, removed, moved or
+    changed, or when two overlapping edits swapped their stacking order.
+    """
+    old_keys, new_keys = _occurrences(old), _occurrences(new)
+    old_set, new_set = set(old_keys), set(new_keys)
+    dirty = set()
+    for placement, _ in old_set.symmetric_difference(new_set):
+        dirty |= _tiles_for(_placement_box(placement), width, height)
+    old_common = [k for k in old_keys if k in new_set]
+    new_common = [k for k in new_keys if k in old_set]
+    if old_common != new_common:
+        old_rank = {k: i for i, k in enumerate(old_common)}
+        boxes = [(k, _placement_box(k[0])) for k in new_common]
+        for i, (a, box_a) in enumerate(boxes):
+            for b, box_b in boxes[i + 1:]:
+                # Identical placements render identically, whatever their order
+                if old_rank[a] > old_rank[b] and a[0] != b[0]:
+                    shared = _overlap(box_a, box_b)
+                    if shared:
+                        dirty |= _tiles_for(shared, width, height)
+    return dirty
+
+
+def revision_of(placements):
+    digest = hashlib.sha256(repr(list(placements)).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class _Canvas:
+    """Cached base image plus the last composite made from it."""
+
+    def __init__(self, base):
+        self.base = base
+        self.composite = base.copy()
+        self.placements = []
+        self.revision = revision_of([])
+        self.lock = threading.Lock()
+        self.nbytes = 2 * _image_bytes(base)
+
+
+class TextCompositor:
+    """Composites text layers onto cached base images, re-rendering only dirty tiles.
+
+    Bases are cached by the SHA-256 of the uploaded image together with
+    their last composite; rendered layers are cached by TextSpec. Both
+    caches are LRU and bounded in bytes (max_base_bytes, max_layer_bytes);
+    an entry larger than its whole budget is used once and not cached.
+    A request only recomposites the TILE_SIZE tiles touched by edits that
+    were added, removed, moved or changed since that composite.
+    """
+
+    def __init__(self, max_base_bytes=256 * 1024 * 1024, max_layer_bytes=64 * 1024 * 1024):
+        self.max_base_bytes = max_base_bytes
+        self.max_layer_bytes = max_layer_bytes
+        self._canvases = OrderedDict()
+        self._layers = OrderedDict()
+        self._base_bytes = 0
+        self._layer_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def base_id(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def base_size(self, base_id):
+        """(width, height) of a cached base, or None."""
+        with self._lock:
+            canvas = self._canvases.get(base_id)
+            return canvas.base.size if canvas is not None else None
+
+    def _canvas(self, base_id, load_base):
+        with self._lock:
+            canvas = self._canvases.get(base_id)
+            if canvas is not None:
+                self._canvases.move_to_end(base_id)
+                metrics.incr('compositor.base_cache.hit')
+                return canvas
+        metrics.incr('compositor.base_cache.miss')
+        if load_base is None:
+            return None
+        canvas = _Canvas(load_base())
+        if canvas.nbytes > self.max_base_bytes:
+            return canvas
+        with self._lock:
+            if base_id in self._canvases:
+                canvas = self._canvases[base_id]
+            else:
+                self._canvases[base_id] = canvas
+                self._base_bytes += canvas.nbytes
+            self._canvases.move_to_end(base_id)
+            while self._base_bytes > self.max_base_bytes:
+                _, evicted = self._canvases.popitem(last=False)
+                self._base_bytes -= evicted.nbytes
+            metrics.set_gauge('compositor.base_cache_mb', round(self._base_bytes / (1024 * 1024), 1))
+        return canvas
+
+    def layer(self, spec):
+        with self._lock:
+            layer = self._layers.get(spec)
+            if layer is not None:
+                self._layers.move_to_end(spec)
+                metrics.incr('compositor.layer_cache.hit')
+                return layer
+        metrics.incr('compositor.layer_cache.miss')
+        layer = render_layer(spec)
+        nbytes = _image_bytes(layer)
+        if nbytes > self.max_layer_bytes:
+            return layer
+        with self._lock:
+            if spec not in self._layers:
+                self._layer_bytes += nbytes
+            self._layers[spec] = layer
+            while self._layer_bytes > self.max_layer_bytes:
+                _, evicted = self._layers.popitem(last=False)
+                self._layer_bytes -= _image_bytes(evicted)
+            metrics.set_gauge('compositor.layer_cache_mb', round(self._layer_bytes / (1024 * 1024), 1))
+        return layer
+
+    def compose(self, base_id, placements, load_base=None):
+        """Bring the base's composite up to date with `placements`.
+
+        Bboxes larger than the image are capped at its size (clip_to_image).
+        Returns a CompositeResult, or None when base_id is not cached and no
+        load_base callable was given.
+        """
+        canvas = self._canvas(base_id, load_base)
+        if canvas is None:
+            return None
+        with canvas.lock:
+            width, height = canvas.base.size
+            previous_revision = canvas.revision
+            new = [clip_to_image(placement, width, height) for placement in placements]
+            dirty = dirty_tiles(canvas.placements, new, width, height)
+
+            tiles = []
+            for col, row in sorted(dirty):
+                box = (col * TILE_SIZE, row * TILE_SIZE,
+                       min(width, (col + 1) * TILE_SIZE), min(height, (row + 1) * TILE_SIZE))
+                tiles.append((box, canvas.base.crop(box)))
+            # Placements outermost (in stacking order), so at most one uncached layer is alive at a time
+            for placement in new:
+                px1, py1, px2, py2 = _placement_box(placement)
+                layer = None
+                for box, tile in tiles:
+                    ix1, iy1 = max(box[0], px1), max(box[1], py1)
+                    ix2, iy2 = min(box[2], px2), min(box[3], py2)
+                    if ix1 >= ix2 or iy1 >= iy2:
+                        continue
+                    if layer is None:
+                        layer = self.layer(placement.spec)
+                    piece = layer.crop((ix1 - px1, iy1 - py1, ix2 - px1, iy2 - py1))
+                    # Pasting with the layer's own alpha as mask is "over" compositing on an opaque base
+                    tile.paste(piece, (ix1 - box[0], iy1 - box[1]), piece)
+            for box, tile in tiles:
+                canvas.composite.paste(tile, box[:2])
+            canvas.placements = new
+            canvas.revision = revision_of(new)
+            metrics.incr('compositor.dirty_tiles', len(tiles))
+            return CompositeResult(canvas.composite.copy(), canvas.revision, previous_revision,
+                                   [(box, canvas.composite.crop(box)) for box, _ in tiles])
+
+
+class CompositeResult:
+    """The composite after a request and the tiles that changed to produce it.
+
+    previous_revision identifies the composite the tiles apply on top of.
+    """
+
+    def __init__(self, image, revision, previous_revision, tiles):
+        self.image = image
+        self.revision = revision
+        self.previous_revision = previous_revision
+        self.tiles = tiles
@@ -0,0 +1,133 @@
+"""Benchmark region-local inpainting against the previous full-frame inpaint.
+
+Usage:
+    python tools/bench_inpaint.py
+    python tools/bench_inpaint.py --sizes 1000 2000 4000 --coverage 0.01 0.05 --workers 4
+    python tools/bench_inpaint.py --quality-sizes 500 1000 --quality-coverage 0.01
+
+Synthetic textured images get random text-like boxes covering the given
+fraction of the frame. For each case this reports the full-frame
+cv2.inpaint time (what erase_text_regions did before), the region-local
+time sequentially and on a thread pool, and how far the outputs differ.
+A second table compares inpaint_hq (glyph pixels only) with TELEA on
+textured and flat (document-like) backgrounds: time and mean/max error
+inside the word boxes against the image before the text was drawn.
+Everything runs offline.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from inpainting import inpaint_text_regions  # noqa: E402
+
+
+def synthetic_case(size, coverage, seed=0, background='textured'):
+    """A size x size image, word boxes covering ~coverage of it and the image before the text.
+
+    background is 'textured' (smooth noise) or 'flat' (a light gradient, like a document).
+    """
+    rng = np.random.default_rng(seed)
+    if background == 'flat':
+        xx, yy = np.meshgrid(np.linspace(0, 1, size), np.linspace(0, 1, size))
+        img = np.stack([200 + 40 * xx, 220 - 30 * yy, np.full_like(xx, 235)], axis=-1).astype(np.uint8)
+    else:
+        img = cv2.resize(rng.integers(0, 255, (size // 16, size // 16, 3), dtype=np.uint8), (size, size),
+                         interpolation=cv2.INTER_CUBIC)
+    clean = img.copy()
+    words, covered = [], 0
+    while covered < coverage * size * size:
+        h = int(rng.integers(16, 48))
+        w = int(h * rng.uniform(2, 8))
+        x, y = int(rng.integers(0, size - w)), int(rng.integers(0, size - h))
+        cv2.putText(img, 'Text', (x, y + h - 4), cv2.FONT_HERSHEY_SIMPLEX, h / 40, (0, 0, 0), 2)
+        words.append({'bbox': {'x': x, 'y': y, 'width': w, 'height': h}})
+        covered += w * h
+    return img, words, clean
+
+
+def box_mask(shape, words):
+    mask = np.zeros(shape[:2], dtype=bool)
+    for word in words:
+        b = word['bbox']
+        mask[b['y']:b['y'] + b['height'], b['x']:b['x'] + b['width']] = True
+    return mask
+
+
+def full_frame_inpaint(img, words, radius=3):
+    """The previous implementation: one mask and one inpaint over the whole image."""
+    h, w = img.shape[:2]
+    mask = np.zeros((h, w), dtype=np.uint8)
+    for word in words:
+        b = word['bbox']
+        mask[max(0, b['y']):min(h, b['y'] + b['height']), max(0, b['x']):min(w, b['x'] + b['width'])] = 255
+    mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=1)
+    return cv2.inpaint(img, mask, radius, cv2.INPAINT_TELEA)
+
+
+def best_time(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--coverage', type=float, nargs='+', default=[0.01, 0.05, 0.2])
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--quality-sizes', type=int, nargs='*', default=[1000, 2000])
+    parser.add_argument('--quality-coverage', type=float, nargs='+', default=[0.01, 0.05])
+    args = parser.parse_args(argv)
+
+    header = ['size', 'text area', 'words', 'full-frame ms', 'regions ms', f'regions x{args.workers} ms',
+              'speedup', 'max diff', 'mean diff']
+    print('| ' + ' | '.join(header) + ' |')
+    print('|' + '---|' * len(header))
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for size in args.sizes:
+            for coverage in args.coverage:
+                img, words, _ = synthetic_case(size, coverage)
+                full_s, expected = best_time(lambda: full_frame_inpaint(img.copy(), words), args.repeats)
+                seq_s, actual = best_time(lambda: inpaint_text_regions(img.copy(), words), args.repeats)
+                par_s, _ = best_time(lambda: inpaint_text_regions(img.copy(), words, executor=pool), args.repeats)
+                diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+                row = [f'{size}x{size}', f'{coverage:.0%}', len(words), f'{1000 * full_s:.1f}', f'{1000 * seq_s:.1f}',
+                       f'{1000 * par_s:.1f}', f'{full_s / min(seq_s, par_s):.1f}x', int(diff.max()),
+                       f'{statistics.fmean(diff.ravel().tolist()) if diff.size < 2_000_000 else diff.mean():.4f}']
+                print('| ' + ' | '.join(str(v) for v in row) + ' |')
+
+    if not args.quality_sizes:
+        return
+    print()
+    header = ['background', 'size', 'text area', 'TELEA ms', 'inpaint_hq ms', 'TELEA mean err', 'inpaint_hq mean err',
+              'TELEA max err', 'inpaint_hq max err']
+    print('| ' + ' | '.join(header) + ' |')
+    print('|' + '---|' * len(header))
+    for background in ('textured', 'flat'):
+        for size in args.quality_sizes:
+            for coverage in args.quality_coverage:
+                img, words, clean = synthetic_case(size, coverage, background=background)
+                inside = box_mask(img.shape, words)
+                telea_s, telea = best_time(lambda: inpaint_text_regions(img.copy(), words), args.repeats)
+                hq_s, hq = best_time(lambda: inpaint_text_regions(img.copy(), words, high_quality=True), args.repeats)
+                errors = [np.abs(out.astype(np.int16) - clean.astype(np.int16))[inside] for out in (telea, hq)]
+                row = [background, f'{size}x{size}', f'{coverage:.0%}', f'{1000 * telea_s:.1f}', f'{1000 * hq_s:.1f}',
+                       *(f'{e.mean():.2f}' for e in errors), *(int(e.max()) for e in errors)]
+                print('| ' + ' | '.join(str(v) for v in row) + ' |')
+
+
+if __name__ == '__main__':
+    main()
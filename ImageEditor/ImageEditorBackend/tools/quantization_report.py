@@ -0,0 +1,138 @@
+"""Compare quantized INT8 models against FP32 on local fixture images.
+
+Usage:
+    python tools/quantization_report.py --fixtures ./fixtures --models isnet-general-use u2net
+    python tools/quantization_report.py --fixtures ./fixtures --json report.json
+
+For every model with an INT8 variant (see tools/quantize_models.py) this
+reports mask IoU against the FP32 mask, median inference latency and the
+resident memory of a process holding the loaded session. Each
+(model, precision) pair runs in a fresh process so memory numbers do not
+leak into each other. Everything runs offline on the given fixtures.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+DEFAULT_MODELS = ['isnet-general-use', 'u2net', 'u2net_human_seg', 'u2netp']
+
+
+def fixture_paths(directory):
+    return [os.path.join(directory, n) for n in sorted(os.listdir(directory)) if n.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def _measure(model_name, precision, paths, repeats):
+    """Child process: load one session, time it on every fixture, return masks."""
+    sys.path.insert(0, BACKEND_DIR)
+    from PIL import Image
+    from rembg import remove
+
+    import metrics
+    from model_registry import get_session
+
+    rss_before = metrics.process_rss_bytes()
+    session = get_session(model_name, precision)
+    rss_loaded = metrics.process_rss_bytes()
+
+    masks, latencies = [], []
+    for path in paths:
+        with Image.open(path) as img:
+            img = img.convert('RGBA')
+        remove(img, session=session, only_mask=True)  # warm-up
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            mask = remove(img, session=session, only_mask=True)
+            timings.append(time.perf_counter() - start)
+        latencies.append(statistics.median(timings))
+        masks.append(np.asarray(mask.convert('L')) > 127)
+    return {
+        'masks': masks,
+        'latencies': latencies,
+        'rssLoadedMb': (rss_loaded - rss_before) / 2**20,
+        'rssPeakMb': metrics.process_rss_bytes() / 2**20,
+    }
+
+
+def measure(model_name, precision, paths, repeats):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_measure, (model_name, precision, paths, repeats))
+
+
+def iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return 1.0 if union == 0 else float(np.logical_and(a, b).sum() / union)
+
+
+def compare(model_name, paths, repeats):
+    fp32 = measure(model_name, 'fp32', paths, repeats)
+    int8 = measure(model_name, 'int8', paths, repeats)
+    ious = [iou(a, b) for a, b in zip(fp32['masks'], int8['masks'])]
+    fp32_ms = 1000 * statistics.median(fp32['latencies'])
+    int8_ms = 1000 * statistics.median(int8['latencies'])
+    return {
+        'model': model_name,
+        'fixtures': len(paths),
+        'meanIoU': round(statistics.mean(ious), 4),
+        'minIoU': round(min(ious), 4),
+        'fp32LatencyMs': round(fp32_ms, 1),
+        'int8LatencyMs': round(int8_ms, 1),
+        'speedup': round(fp32_ms / int8_ms, 2) if int8_ms else None,
+        'fp32SessionMb': round(fp32['rssLoadedMb'], 1),
+        'int8SessionMb': round(int8['rssLoadedMb'], 1),
+        'fp32PeakRssMb': round(fp32['rssPeakMb'], 1),
+        'int8PeakRssMb': round(int8['rssPeakMb'], 1),
+    }
+
+
+def print_table(rows):
+    header = ['model', 'mean IoU', 'min IoU', 'fp32 ms', 'int8 ms', 'speedup',
+              'fp32 MB', 'int8 MB', 'fp32 peak', 'int8 peak']
+    print('| ' + ' | '.join(header) + ' |')
+    print('|' + '---|' * len(header))
+    for r in rows:
+        values = [r['model'], r['meanIoU'], r['minIoU'], r['fp32LatencyMs'], r['int8LatencyMs'], r['speedup'],
+                  r['fp32SessionMb'], r['int8SessionMb'], r['fp32PeakRssMb'], r['int8PeakRssMb']]
+        print('| ' + ' | '.join(str(v) for v in values) + ' |')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', required=True, help='folder of local test images')
+    parser.add_argument('--models', nargs='+', default=DEFAULT_MODELS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    from model_registry import has_quantized_variant
+
+    paths = fixture_paths(args.fixtures)
+    if not paths:
+        raise SystemExit(f'No fixture images found in {args.fixtures}')
+
+    rows = []
+    for model_name in args.models:
+        if not has_quantized_variant(model_name):
+            print(f'skipping {model_name}: no int8 variant (run tools/quantize_models.py)', file=sys.stderr)
+            continue
+        rows.append(compare(model_name, paths, args.repeats))
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Produce INT8 variants of the background-removal models.
+
+Usage:
+    python tools/quantize_models.py --models isnet-general-use u2net u2net_human_seg
+    python tools/quantize_models.py --method static --calibration-dir ./calib --models u2net
+
+Dynamic quantization needs no data. Static quantization runs the FP32 model
+over a small calibration set (a folder of images) and records the exact
+input tensors its session produces, so preprocessing always matches the
+model. Output files are written where model_registry looks for them
+(QUANTIZED_MODEL_DIR, default ~/.u2net/quantized).
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from model_registry import QUANTIZED_MODEL_DIR, quantized_model_paths, session_class  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('quantize_models')
+
+DEFAULT_MODELS = ['isnet-general-use', 'u2net', 'u2net_human_seg', 'u2netp']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def fp32_model_paths(model_name):
+    """Download (if needed) and return the FP32 ONNX file(s) of a model."""
+    paths = session_class(model_name).download_models()
+    return list(paths) if model_name == 'sam' else [paths]
+
+
+def calibration_images(directory, limit):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    for name in names[:limit]:
+        with Image.open(os.path.join(directory, name)) as img:
+            yield img.convert('RGBA')
+
+
+class RecordedInputReader:
+    """CalibrationDataReader over inputs captured from the FP32 session."""
+
+    def __init__(self, feeds):
+        self._feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+
+def record_model_inputs(model_name, images):
+    """Run the FP32 session on each image and capture the tensors fed to ONNX."""
+    from rembg import new_session
+
+    session = new_session(model_name)
+    feeds = []
+    run = session.inner_session.run
+
+    def recording_run(output_names, input_feed, *args, **kwargs):
+        feeds.append({name: value.copy() for name, value in input_feed.items()})
+        return run(output_names, input_feed, *args, **kwargs)
+
+    session.inner_session.run = recording_run
+    for img in images:
+        session.predict(img)
+    return feeds
+
+
+def quantize(model_name, method, output_dir, calibration_dir=None, calibration_count=16):
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    sources = fp32_model_paths(model_name)
+    targets = quantized_model_paths(model_name, 'int8', output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if method == 'static':
+        if model_name == 'sam':
+            raise SystemExit('Static quantization is not supported for sam (encoder/decoder pair); use --method dynamic')
+        if not calibration_dir:
+            raise SystemExit('--calibration-dir is required for static quantization')
+        feeds = record_model_inputs(model_name, calibration_images(calibration_dir, calibration_count))
+        if not feeds:
+            raise SystemExit(f'No calibration images found in {calibration_dir}')
+        logger.info(f'{model_name}: calibrating on {len(feeds)} image(s)')
+        quantize_static(
+            sources[0], targets[0], RecordedInputReader(feeds),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    else:
+        for source, target in zip(sources, targets):
+            quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+
+    for source, target in zip(sources, targets):
+        logger.info(f'{model_name}: {os.path.getsize(source) / 2**20:.1f} MB -> '
+                    f'{os.path.getsize(target) / 2**20:.1f} MB ({target})')
+    return targets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=DEFAULT_MODELS)
+    parser.add_argument('--method', choices=['dynamic', 'static'], default='dynamic')
+    parser.add_argument('--calibration-dir', help='folder of representative images (static only)')
+    parser.add_argument('--calibration-count', type=int, default=16)
+    parser.add_argument('--output-dir', default=QUANTIZED_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    for model_name in args.models:
+        quantize(model_name, args.method, args.output_dir, args.calibration_dir, args.calibration_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Replay a traffic capture against a local backend and report how it held up.
+
+Usage:
+    TRAFFIC_CAPTURE_PATH=capture.jsonl python server.py     # record
+    python tools/replay_traffic.py capture.jsonl
+    python tools/replay_traffic.py capture.jsonl --speedup 4 --concurrency 16
+    python tools/replay_traffic.py capture.jsonl --speedup 0 --endpoints /remove-bg --json report.json
+
+Requests are sent at their recorded offsets divided by --speedup (0 sends
+them as fast as --concurrency allows). Uploads use the captured payloads
+when the capture was made with TRAFFIC_CAPTURE_PAYLOADS, otherwise
+synthetic images of the recorded format and size (and synthetic textEdits
+of the recorded count). Requests that cannot be reproduced (server-side
+video_path, integrate-text by baseId only) are skipped and counted.
+
+While replaying, /metrics is polled for the server's resident memory and
+admission state. The report gives throughput, latency percentiles and
+error rates per endpoint, how far sends slipped behind schedule, and
+memory over time. Only the given --url is contacted.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+PIL_FORMATS = {'JPEG': ('JPEG', 'image/jpeg', '.jpg'), 'WEBP': ('WEBP', 'image/webp', '.webp')}
+
+
+def load_capture(path, endpoints=None, limit=None):
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if endpoints and entry.get('endpoint') not in endpoints:
+                continue
+            entries.append(entry)
+    entries.sort(key=lambda e: e['t'])
+    return entries[:limit] if limit else entries
+
+
+class RequestBuilder:
+    """Turns capture entries into multipart bodies; synthetic images are cached by size."""
+
+    def __init__(self, payload_dir):
+        self.payload_dir = payload_dir
+        self._synthetic = {}
+        self._lock = threading.Lock()
+
+    def _payload(self, digest):
+        if not digest or not self.payload_dir:
+            return None
+        path = os.path.join(self.payload_dir, digest)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _synthetic_image(self, fmt, width, height):
+        pil_format, content_type, ext = PIL_FORMATS.get(fmt, ('PNG', 'image/png', '.png'))
+        key = (pil_format, width, height)
+        with self._lock:
+            cached = self._synthetic.get(key)
+        if cached is None:
+            # Smooth gradient plus noise: compresses like a photo, not like a flat fill
+            rng = np.random.default_rng(width * 7919 + height)
+            y, x = np.mgrid[0:height, 0:width]
+            base = np.stack([x * 255 // max(1, width), y * 255 // max(1, height), (x + y) % 256], axis=-1)
+            pixels = np.clip(base + rng.integers(-24, 24, size=base.shape), 0, 255).astype(np.uint8)
+            buf = io.BytesIO()
+            Image.fromarray(pixels).save(buf, format=pil_format)
+            cached = (buf.getvalue(), content_type, ext)
+            with self._lock:
+                self._synthetic[key] = cached
+        return cached
+
+    def _upload(self, upload):
+        data = self._payload(upload.get('payload'))
+        if data is not None:
+            return data, 'application/octet-stream', ''
+        if 'invalid' in upload or not upload.get('width'):
+            return b'not an image', 'application/octet-stream', ''
+        return self._synthetic_image(upload.get('format'), upload['width'], upload['height'])
+
+    def _text_edits(self, summary, files):
+        data = self._payload(summary.get('payload'))
+        if data is not None:
+            return data.decode('utf-8')
+        width = max([u.get('width') or 0 for u in files] + [400])
+        height = max([u.get('height') or 0 for u in files] + [300])
+        edits = []
+        for i in range(summary.get('count', 0)):
+            edits.append({
+                'text': f'Sample text {i}',
+                'bbox': {'x': (i * 137) % max(1, width - 200), 'y': (i * 53) % max(1, height - 40), 'width': 200, 'height': 40},
+                'fill': '#222222',
+                'fontSize': 24,
+            })
+        return json.dumps(edits)
+
+    def build(self, entry):
+        """((body, content type), None), or (None, reason) when it cannot be replayed."""
+        present = entry.get('present', [])
+        files = entry.get('files', [])
+        if 'video_path' in present:
+            return None, 'server-side video_path'
+        if entry['endpoint'] == '/integrate-text' and not files and 'baseId' in present:
+            return None, 'baseId without upload'
+        fields = list(entry.get('params', {}).items())
+        if 'textEdits' in entry:
+            fields.append(('textEdits', self._text_edits(entry['textEdits'], files)))
+        return encode_multipart(fields, [(u['field'], *self._upload(u)) for u in files]), None
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, value in fields:
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode('utf-8'))
+        out.write(str(value).encode('utf-8'))
+        out.write(b'\r\n')
+    for i, (name, data, content_type, ext) in enumerate(files):
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="upload{i}{ext}"\r\n'
+                  f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8'))
+        out.write(data)
+        out.write(b'\r\n')
+    out.write(f'--{boundary}--\r\n'.encode('utf-8'))
+    return out.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def send(url, body, content_type, timeout):
+    """POST and read the whole response (streams included); returns (status, bytes)."""
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': content_type}, method='POST')
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, len(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, len(e.read())
+    except (urllib.error.URLError, OSError) as e:
+        return f'error: {getattr(e, "reason", e)}', 0
+
+
+class MetricsPoller(threading.Thread):
+    """Samples /metrics every `interval` seconds: RSS and admission state."""
+
+    def __init__(self, base_url, interval):
+        super().__init__(daemon=True)
+        self.url = base_url.rstrip('/') + '/metrics'
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+        self.start_time = None
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        while True:
+            try:
+                with urllib.request.urlopen(self.url, timeout=max(1.0, self.interval)) as resp:
+                    data = json.loads(resp.read())
+                admission = data.get('admission', {})
+                self.samples.append({
+                    't': round(time.perf_counter() - self.start_time, 2),
+                    'rssMb': round(data.get('gauges', {}).get('process_rss_bytes', 0) / 2 ** 20, 1),
+                    'inFlight': admission.get('inFlight'),
+                    'queueDepth': admission.get('queueDepth'),
+                })
+            except (urllib.error.URLError, OSError, ValueError):
+                pass
+            if self._done.wait(self.interval):
+                return
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _pct(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def replay(entries, base_url, builder, speedup, concurrency, timeout):
+    results = []
+    skipped = Counter()
+    lock = threading.Lock()
+    t0 = entries[0]['t'] if entries else 0.0
+    start = time.perf_counter()
+
+    def run(entry, scheduled):
+        body, reason = builder.build(entry)
+        if body is None:
+            with lock:
+                skipped[reason] += 1
+            return
+        sent = time.perf_counter()
+        status, size = send(base_url.rstrip('/') + entry['endpoint'], *body, timeout)
+        done = time.perf_counter()
+        with lock:
+            results.append({
+                'endpoint': entry['endpoint'],
+                'status': status,
+                'latency': done - sent,
+                'lag': max(0.0, sent - scheduled),
+                'end': done - start,
+                'bytes': size,
+                'recordedMs': entry.get('durationMs'),
+            })
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in entries:
+            scheduled = start + ((entry['t'] - t0) / speedup if speedup > 0 else 0.0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, entry, scheduled)
+    return results, skipped, time.perf_counter() - start
+
+
+def summarize(results, skipped, wall, memory):
+    by_endpoint = defaultdict(list)
+    for r in results:
+        by_endpoint[r['endpoint']].append(r)
+    endpoints = {}
+    for name, rows in sorted(by_endpoint.items()):
+        ok = [r for r in rows if isinstance(r['status'], int) and r['status'] < 400]
+        latencies = [1000 * r['latency'] for r in ok]
+        recorded = [r['recordedMs'] for r in ok if r['recordedMs'] is not None]
+        endpoints[name] = {
+            'requests': len(rows),
+            'ok': len(ok),
+            'errorRate': round(1 - len(ok) / len(rows), 4),
+            'statuses': dict(Counter(str(r['status']) for r in rows)),
+            'throughput': round(len(rows) / wall, 2) if wall else 0.0,
+            'p50Ms': round(_pct(latencies, 50), 1),
+            'p90Ms': round(_pct(latencies, 90), 1),
+            'p99Ms': round(_pct(latencies, 99), 1),
+            'maxMs': round(max(latencies, default=0.0), 1),
+            'recordedP50Ms': round(statistics.median(recorded), 1) if recorded else None,
+        }
+    lags = [1000 * r['lag'] for r in results]
+    rss = [s['rssMb'] for s in memory]
+    return {
+        'requests': len(results),
+        'skipped': dict(skipped),
+        'wallSeconds': round(wall, 2),
+        'throughput': round(len(results) / wall, 2) if wall else 0.0,
+        'errorRate': round(sum(1 for r in results if not (isinstance(r['status'], int) and r['status'] < 400))
+                           / len(results), 4) if results else 0.0,
+        'scheduleLagP95Ms': round(_pct(lags, 95), 1),
+        'rssMb': {'start': rss[0], 'peak': max(rss), 'end': rss[-1]} if rss else None,
+        'endpoints': endpoints,
+        'memory': memory,
+    }
+
+
+def print_report(report, timeline_rows=20):
+    print(f"{report['requests']} requests in {report['wallSeconds']}s "
+          f"({report['throughput']} req/s), error rate {100 * report['errorRate']:.1f}%, "
+          f"schedule lag p95 {report['scheduleLagP95Ms']} ms")
+    if report['skipped']:
+        print('Skipped: ' + ', '.join(f'{n} ({reason})' for reason, n in report['skipped'].items()))
+    print()
+    print('| endpoint | requests | errors | req/s | p50 ms | p90 ms | p99 ms | max ms | recorded p50 ms | statuses |')
+    print('|---|---|---|---|---|---|---|---|---|---|')
+    for name, e in report['endpoints'].items():
+        statuses = ' '.join(f'{s}:{n}' for s, n in sorted(e['statuses'].items()))
+        print(f"| {name} | {e['requests']} | {100 * e['errorRate']:.1f}% | {e['throughput']} | {e['p50Ms']} | "
+              f"{e['p90Ms']} | {e['p99Ms']} | {e['maxMs']} | {e['recordedP50Ms'] or '-'} | {statuses} |")
+    memory = report['memory']
+    if memory:
+        rss = report['rssMb']
+        print()
+        print(f"RSS: {rss['start']} MB at start, {rss['peak']} MB peak, {rss['end']} MB at end")
+        print()
+        print('| t (s) | RSS MB | in flight | queued |')
+        print('|---|---|---|---|')
+        step = max(1, len(memory) // timeline_rows)
+        for s in memory[::step]:
+            print(f"| {s['t']} | {s['rssMb']} | {s['inFlight']} | {s['queueDepth']} |")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='JSONL file written with TRAFFIC_CAPTURE_PATH')
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='Local backend to replay against')
+    parser.add_argument('--payloads', help='Payload directory (default: <capture>.payloads if it exists)')
+    parser.add_argument('--speedup', type=float, default=1.0, help='Divide recorded gaps by this; 0 = no gaps')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum requests in flight')
+    parser.add_argument('--endpoints', nargs='+', help='Only replay these endpoints (e.g. /remove-bg)')
+    parser.add_argument('--limit', type=int, help='Replay only the first N requests')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Per-request timeout in seconds')
+    parser.add_argument('--metrics-interval', type=float, default=1.0, help='Seconds between /metrics polls')
+    parser.add_argument('--json', help='Also write the full report (including the memory timeline) here')
+    args = parser.parse_args(argv)
+
+    entries = load_capture(args.capture, args.endpoints, args.limit)
+    if not entries:
+        sys.exit('No requests to replay')
+    payload_dir = args.payloads or f'{args.capture}.payloads'
+    builder = RequestBuilder(payload_dir if os.path.isdir(payload_dir) else None)
+
+    poller = MetricsPoller(args.url, args.metrics_interval)
+    poller.start()
+    try:
+        results, skipped, wall = replay(entries, args.url, builder, args.speedup, max(1, args.concurrency), args.timeout)
+    finally:
+        poller.stop()
+
+    report = summarize(results, skipped, wall, poller.samples)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
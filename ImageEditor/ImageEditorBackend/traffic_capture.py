@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from image_ingest import ImageTooLarge, InvalidImage
+
+logger = logging.getLogger(__name__)
+
+# Form fields recorded verbatim; everything else is dropped or summarised
+# (textEdits by count, ids and server paths by presence) so captures carry
+# no user text, file names or client addresses
+CAPTURED_PARAMS = (
+    'model', 'precision', 'alpha_matting', 'alpha_matting_foreground_threshold',
+    'alpha_matting_background_threshold', 'alpha_matting_erode_size', 'progressive',
+    'text_clean_method', 'output', 'keyframe_interval', 'scene_threshold',
+)
+PRESENCE_PARAMS = ('baseId', 'baseRevision', 'video_path')
+
+
+def _sha256(stream, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        stream.seek(0)
+    return digest.hexdigest(), size
+
+
+class TrafficRecorder:
+    """Appends one anonymised JSON line per request to a local capture file.
+
+    With payload_dir set, uploads (and textEdits) are also stored there,
+    content-addressed by SHA-256, so a replay can send the real bytes.
+    sample_rate (0-1) records only a fraction of requests.
+    """
+
+    def __init__(self, path, payload_dir=None, sample_rate=1.0):
+        self.path = path
+        self.payload_dir = payload_dir
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if payload_dir:
+            os.makedirs(payload_dir, exist_ok=True)
+
+    def sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _save_payload(self, digest, write):
+        path = os.path.join(self.payload_dir, digest)
+        if os.path.exists(path):
+            return
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def describe(self, endpoint, files, form, header_reader, max_pixels=None):
+        """Request metadata for the capture; every upload stream is rewound."""
+        entry = {'t': round(time.time(), 3), 'endpoint': endpoint}
+        entry['params'] = {name: form[name] for name in CAPTURED_PARAMS if name in form}
+        present = [name for name in PRESENCE_PARAMS if form.get(name)]
+        if present:
+            entry['present'] = present
+        if 'textEdits' in form:
+            text_edits = form['textEdits']
+            try:
+                edits = json.loads(text_edits)
+                entry['textEdits'] = {'count': len(edits) if isinstance(edits, list) else 0}
+            except ValueError:
+                entry['textEdits'] = {'count': 0, 'invalid': True}
+            if self.payload_dir:
+                data = text_edits.encode('utf-8')
+                digest = hashlib.sha256(data).hexdigest()
+                self._save_payload(digest, lambda f: f.write(data))
+                entry['textEdits']['payload'] = digest
+
+        uploads = []
+        for field, storage in files.items(multi=True):
+            upload = {'field': field}
+            stream = storage.stream
+            try:
+                header = header_reader(stream, max_pixels)
+                upload.update(format=header.format, width=header.width, height=header.height)
+            except (ImageTooLarge, InvalidImage) as e:
+                upload['invalid'] = str(e)
+            digest, upload['bytes'] = _sha256(stream)
+            if self.payload_dir:
+                def copy(f):
+                    try:
+                        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                            f.write(chunk)
+                    finally:
+                        stream.seek(0)
+                self._save_payload(digest, copy)
+                upload['payload'] = digest
+            uploads.append(upload)
+        entry['files'] = uploads
+        return entry
+
+    def record(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        try:
+            with self._lock, open(self.path, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f'Failed to write traffic capture: {e}')
@@ -0,0 +1,133 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def iter_video_frames(path, max_side=None):
+    """Yield RGB frames (numpy arrays) from a local video file, one at a time."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f'Cannot open video: {os.path.basename(path)}')
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            yield _limit_side(frame, max_side)
+    finally:
+        capture.release()
+
+
+def _limit_side(frame, max_side):
+    h, w = frame.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return frame
+    ratio = max_side / max(h, w)
+    return cv2.resize(frame, (max(1, int(w * ratio)), max(1, int(h * ratio))), interpolation=cv2.INTER_AREA)
+
+
+def _histogram(frame):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+class MaskPropagator:
+    """Temporal mask propagation between keyframes.
+
+    Full segmentation (segment_fn) only runs on keyframes: the first frame,
+    every keyframe_interval frames, on a scene change (HSV histogram
+    distance) or when the propagated mask drifts (photometric warp error).
+    In between, the previous mask is warped into the current frame with
+    dense optical flow computed at flow_side resolution.
+
+    Only the previous frame and mask are kept, so memory is constant in the
+    clip length.
+    """
+
+    def __init__(self, segment_fn, keyframe_interval=12, scene_threshold=0.4,
+                 drift_threshold=18.0, flow_side=480, keyframe_blend=0.25):
+        self.segment_fn = segment_fn
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.scene_threshold = scene_threshold
+        self.drift_threshold = drift_threshold
+        self.flow_side = flow_side
+        self.keyframe_blend = keyframe_blend
+        self._prev_gray = None
+        self._prev_mask = None
+        self._prev_hist = None
+        self._since_keyframe = 0
+
+    def _small_gray(self, frame):
+        return cv2.cvtColor(_limit_side(frame, self.flow_side), cv2.COLOR_RGB2GRAY)
+
+    def _warp_previous(self, gray):
+        """Warp the previous mask into the current frame (flow_side resolution).
+
+        Returns (warped_mask, mean photometric error inside the mask).
+        """
+        # Backward flow: for each current pixel, where it was in the previous frame
+        flow = cv2.calcOpticalFlowFarneback(gray, self._prev_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        h, w = gray.shape
+        grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        map_x = grid_x + flow[..., 0]
+        map_y = grid_y + flow[..., 1]
+        prev_mask_small = cv2.resize(self._prev_mask, (w, h), interpolation=cv2.INTER_LINEAR)
+        warped = cv2.remap(prev_mask_small, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        warped_gray = cv2.remap(self._prev_gray, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        region = warped > 127
+        if not region.any():
+            region = np.ones_like(region)
+        error = float(np.abs(warped_gray.astype(np.int16) - gray.astype(np.int16))[region].mean())
+        return warped, error
+
+    def process(self, frame):
+        """Return (mask uint8 HxW at frame size, info dict) for the next frame."""
+        h, w = frame.shape[:2]
+        gray = self._small_gray(frame)
+        hist = _histogram(_limit_side(frame, self.flow_side))
+
+        reason = None
+        warped = None
+        error = None
+        if self._prev_mask is None:
+            reason = 'first'
+        elif gray.shape != self._prev_gray.shape:
+            reason = 'resize'
+        elif cv2.compareHist(self._prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.scene_threshold:
+            reason = 'scene'
+        else:
+            warped, error = self._warp_previous(gray)
+            if self._since_keyframe >= self.keyframe_interval:
+                reason = 'interval'
+            elif error > self.drift_threshold:
+                reason = 'drift'
+
+        if reason is None:
+            mask = cv2.resize(warped, (w, h), interpolation=cv2.INTER_LINEAR)
+            # Cheap refinement: a light blur keeps upsampled edges smooth
+            mask = cv2.GaussianBlur(mask, (3, 3), 0)
+            self._since_keyframe += 1
+        else:
+            mask = np.asarray(self.segment_fn(Image.fromarray(frame)).convert('L'), dtype=np.uint8)
+            if mask.shape != (h, w):
+                mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+            if reason == 'interval' and self.keyframe_blend > 0:
+                # Blend with the propagated mask so periodic keyframes do not pop
+                propagated = cv2.resize(warped, (w, h), interpolation=cv2.INTER_LINEAR)
+                mask = cv2.addWeighted(mask, 1.0 - self.keyframe_blend, propagated, self.keyframe_blend, 0)
+            self._since_keyframe = 0
+
+        self._prev_gray = gray
+        self._prev_mask = mask
+        self._prev_hist = hist
+        info = {'keyframe': reason is not None, 'reason': reason}
+        if error is not None:
+            info['warpError'] = round(error, 2)
+        return mask, info